@@ -0,0 +1,136 @@
+import argparse
+import logging
+import sys
+
+
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="c64keyboard_emulator", description="Emulator for C64 keyboard"
+    )
+    parser.add_argument(
+        "-d",
+        "--device",
+        dest="devices",
+        action="append",
+        help="serial device, or a tcp://host:port or udp://host:port address; "
+        "repeat to drive several devices with the same input",
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="type text from files or stdin without opening a window",
+    )
+    parser.add_argument(
+        "-t", "--type", default="breadbin", help="C64 type used for the key matrix"
+    )
+    parser.add_argument("-l", "--lang", default="", help="keyboard layout language")
+    parser.add_argument(
+        "--replay", metavar="FILE", help="replay a key recording in headless mode"
+    )
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="replay as fast as the link allows instead of at the recorded timing",
+    )
+    parser.add_argument(
+        "--ipc",
+        nargs="?",
+        const="",
+        metavar="SOCKET",
+        help="accept key commands from other programs on a Unix domain socket",
+    )
+    parser.add_argument(
+        "--latency",
+        metavar="FILE",
+        help="track key latency and write statistics to FILE as JSON",
+    )
+    parser.add_argument(
+        "--log-level",
+        default="INFO",
+        choices=LOG_LEVELS,
+        type=str.upper,
+        help="log messages of this level and above",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="record key handling in a trace buffer, written to FILE on exit "
+        "or SIGUSR1",
+    )
+    parser.add_argument(
+        "--trace-size",
+        type=positive_int,
+        default=65536,
+        metavar="RECORDS",
+        help="number of records kept in the trace buffer",
+    )
+    parser.add_argument(
+        "files", nargs="*", help="files to type in headless mode, - for stdin"
+    )
+    args = parser.parse_args(argv)
+    if args.headless and not args.devices:
+        parser.error("--headless needs at least one -d/--device")
+    check_layout(parser, args.type, args.lang)
+    return args
+
+
+def check_layout(parser, c64_type, lang):
+    from .keyboard_logic import C64KeyboardLogic
+
+    layouts = [layout[:2] for layout in C64KeyboardLogic().get_key_layouts()]
+    if (c64_type, lang or "en") not in layouts:
+        choices = ", ".join(f"-t {t} -l {language}" for t, language in layouts)
+        parser.error(f"No {c64_type} layout in language {lang or 'en'}, use {choices}")
+
+
+def configure_tracing(path, capacity):
+    import atexit
+    import signal
+    from . import trace
+
+    trace.enable(capacity)
+    atexit.register(trace.dump, path)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: trace.dump(path))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    logging.basicConfig(level=args.log_level, format=LOG_FORMAT)
+    if args.trace:
+        configure_tracing(args.trace, args.trace_size)
+
+    if args.headless:
+        from . import headless
+
+        sys.exit(
+            headless.run(
+                args.devices,
+                args.files,
+                args.type,
+                args.lang,
+                replay=args.replay,
+                realtime=not args.fast,
+            )
+        )
+
+    from .keyboard import C64KeyboardEmulator
+
+    emulator = C64KeyboardEmulator()
+    emulator.run(args.devices, args.ipc, args.latency, args.type, args.lang)
+
+
+if __name__ == "__main__":
+    main()
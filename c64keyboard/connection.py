@@ -1,121 +1,95 @@
 import serial
 import serial.tools.list_ports
-import threading
+import os
 import time
-import logging
+from . import hotplug
+from . import protocol
+from .transport import HANDSHAKE_TIMEOUT, Connection
 
 
 BAUD = 19200
-RECONNECT_DELAY = 5  # seconds
-
-
-class SerialConnection:
-    def __init__(self, path=None, callback=None):
-        self.log = logging.getLogger("SerialConnection")
-        self.log.addHandler(self.create_debug_console_handler())
-        self.log.setLevel(logging.DEBUG)
-        self.log.debug(f"Creating serial connection: {path}")
-
-        self.callback = callback
-
-        self.connected = False
-        self.connection_path = path
-        self.monitor_thread = threading.Thread(target=self.monitor_connection)
-        self.monitor_thread.daemon = True
-        self.monitor_thread.start()
-
-    def _connect(self, path=None):
-        if path:
-            self.connection_path = path
-        connect = False
-        for p in serial.tools.list_ports.comports():
-            # self.log.debug(f"Device: {p.device} ; Description: {p.description}")
-            if p.device == self.connection_path:
-                connect = True
-                break
-
-        if not connect:
-            self.log.debug(f"Device {self.connection_path} not found")
-            return None
+CACHED_RATE_TIMEOUT = 0.3  # seconds
+BAUD_RATES = (57600, 115200, 250000)
+BAUD_SWITCH_TIMEOUT = 0.5  # seconds
+BAUD_REVERT_DELAY = 1  # seconds, device falls back when no echo is received
+BAUD_CACHE = {}
 
-        try:
-            self.serial_connection = serial.Serial(self.connection_path, BAUD, timeout=0.1)
-
-            self.serial_connection.write((3).to_bytes(1, byteorder="big"))
-            self.serial_connection.write(b"cbm")
-            self.serial_connection.flush()
-            time.sleep(1)
-            # time.sleep(4)
-            while True:
-                line = self.serial_connection.readline()
-                if not line:
-                    return
-                line = line.decode("utf-8").strip()
-                self.log.debug(f"Received: {line}")
-                if line == "c64":
-                    self.connected = True
-                    break
-        except serial.SerialException as e:
-            self.log.debug(f"Cannot open serial device {self.connection_path}")
-            raise e
-
-        if self.connected:
-            self.post_event("connected")
-
-    def _disconnect(self):
-        self.connected = False
-        if self.serial_connection:
-            self.serial_connection.close()
-        self.post_event("disconnected")
 
-    def connect(self):
-        if not (self.connected or self.connection_path):
-            return
+class SerialConnection(Connection):
+    LOGGER_NAME = "SerialConnection"
 
-        self.log.debug(f"Attempting to reconnect to {self.connection_path}...")
-        if not self.connected:
-            try:
-                self._connect()
-                if self.connected:
-                    self.log.info(f"Connected to {self.connection_path}")
+    def __init__(self, path=None, callback=None, line_callback=None):
+        self.serial_connection = None
+        self.watcher = hotplug.create_watcher()
+        super().__init__(path, callback, line_callback)
 
-            except serial.SerialException:
-                self.log.debug(f"Connection failed.")
+    def open_transport(self, rate=BAUD):
+        self.serial_connection = serial.Serial(self.connection_path, rate, timeout=0.1)
 
-    def set_serial(self, path=None):
-        self.connection_path = path
-        if self.connected:
-            self._disconnect()
-        self.connect()
+    def close_transport(self):
+        if self.serial_connection:
+            self.serial_connection.close()
 
-    def send_data(self, data):
-        try:
-            if self.connected and data:
-                self.serial_connection.write(bytearray([len(data)]) )
-                sent = self.serial_connection.write(data)
-                self.log.debug(f"Data len {len(data)} Sent {sent} bytes")
-                self.serial_connection.flush()
-                return sent
-        except serial.SerialException:
-            self._disconnect()
-        return 0
+    def write_bytes(self, data):
+        self.serial_connection.write(data)
+        self.serial_connection.flush()
 
     def readline(self):
-        try:
-            if self.connected:
-                return self.serial_connection.readline()
-        except serial.SerialException:
-            self._disconnect()
-        return None
-
-    def close(self):
-        if self.connected:
-            self.serial_connection.close()
-            self.connected = False
-            self.post_event("disconnected")
+        return self.serial_connection.readline()
+
+    def open_and_handshake(self):
+        rates = [BAUD]
+        cached_rate = BAUD_CACHE.get(self.connection_path)
+        if cached_rate and cached_rate != BAUD:
+            rates.insert(0, cached_rate)
+
+        for rate in rates:
+            self.open_transport(rate)
+            timeout = HANDSHAKE_TIMEOUT if rate == BAUD else CACHED_RATE_TIMEOUT
+            if self.handshake(timeout):
+                return True
+            self.close_transport()
+        return False
+
+    def after_handshake(self):
+        if (
+            protocol.CAPABILITY_BAUD in self.capabilities
+            and self.serial_connection.baudrate == BAUD
+        ):
+            self.negotiate_baud_rate()
+
+    def negotiate_baud_rate(self):
+        for rate in BAUD_RATES:
+            if rate <= self.serial_connection.baudrate:
+                continue
+            if not self.try_baud_rate(rate):
+                break
+        rate = self.serial_connection.baudrate
+        BAUD_CACHE[self.connection_path] = rate
+        self.log.debug(f"Using {rate} baud on {self.connection_path}")
+
+    def try_baud_rate(self, rate):
+        previous = self.serial_connection.baudrate
+        self.write_frame(protocol.baud_request(rate))
+        if self.read_line(BAUD_SWITCH_TIMEOUT) != protocol.baud_reply(rate):
+            self.log.debug(f"Device refused {rate} baud")
+            return False
+
+        self.serial_connection.baudrate = rate
+        token = os.urandom(4).hex().encode()
+        self.serial_connection.reset_input_buffer()
+        self.write_frame(protocol.ECHO_REQUEST + token)
+        if self.read_line(BAUD_SWITCH_TIMEOUT) == protocol.echo_reply(token):
+            return True
+
+        self.log.debug(f"Echo failed at {rate} baud, falling back to {previous}")
+        self.serial_connection.baudrate = previous
+        time.sleep(BAUD_REVERT_DELAY)
+        self.serial_connection.reset_input_buffer()
+        return False
 
-    def is_connected(self):
-        return self.connected
+    def set_serial(self, path=None):
+        self.set_path(path)
 
     def flush(self):
         try:
@@ -124,31 +98,16 @@ class SerialConnection:
         except serial.SerialException:
             self._disconnect()
 
-    def post_event(self, event_type):
-        if self.callback:
-            event = {"type": event_type, "path": self.connection_path}
-            self.monitor_thread = threading.Thread(target=self.callback(event))
-            self.monitor_thread.start()
+    def device_present(self):
+        if not self.watcher.polling:
+            return os.path.exists(self.connection_path)
+        ports = [p.device for p in serial.tools.list_ports.comports()]
+        return self.connection_path in ports
 
-            # self.callback(event)
+    def wait_for_change(self, timeout):
+        self.watcher.wait(timeout)
 
-    def monitor_connection(self):
-        while self.monitor_thread.daemon:
-            if self.connected:
-                ports = [p.device for p in serial.tools.list_ports.comports()]
-                if self.connection_path not in ports:
-                    self.log.debug(f"Port {self.connection_path} disappeared")
-                    self.connected = False
-                    self.post_event("disconnected")
-            else:
-                self.connect()
-            time.sleep(1)
-
-    def create_debug_console_handler(self):
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.DEBUG)
-        formatter = logging.Formatter(
-            "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-        )
-        console_handler.setFormatter(formatter)
-        return console_handler
+    def monitor_stopped(self):
+        # Closed here rather than in shutdown so a pending wait never sees a
+        # closed descriptor
+        self.watcher.close()
@@ -0,0 +1,190 @@
+import threading
+import time
+from . import transport
+from .paste import PasteStream
+
+
+MAX_BACKLOG = 256  # frames queued for one device before it is skipped
+
+
+# Drives several devices with the same input. A device that falls behind is
+# skipped until it has drained, then resynced with the current key state.
+class ConnectionGroup:
+    def __init__(self, callback=None, line_callback=None, state=None):
+        self.callback = callback
+        self.line_callback = line_callback
+        self.state = state
+        self.tracker = None
+        self.connections = {}
+        self.lagging = set()
+        self.ready_counts = {}
+        self.ready_forwarded = 0
+        self.lock = threading.Lock()
+
+    def add(self, path):
+        with self.lock:
+            if path in self.connections:
+                return self.connections[path]
+            connection = transport.open_connection(
+                path,
+                callback=self.callback,
+                line_callback=lambda line: self.on_device_line(path, line),
+            )
+            connection.set_tracker(self.tracker)
+            self.connections[path] = connection
+            self.ready_counts[path] = self.ready_forwarded
+        return connection
+
+    def remove(self, path):
+        with self.lock:
+            connection = self.connections.pop(path, None)
+            self.lagging.discard(path)
+            self.ready_counts.pop(path, None)
+        # Shutting down waits on the device, so it happens outside the lock
+        if connection:
+            connection.shutdown()
+            connection.dispatch_events()
+
+    def set_paths(self, paths):
+        for path in list(self.connections):
+            if path not in paths:
+                self.remove(path)
+        for path in paths:
+            self.add(path)
+
+    def set_tracker(self, tracker):
+        with self.lock:
+            self.tracker = tracker
+            connections = list(self.connections.values())
+        for connection in connections:
+            connection.set_tracker(tracker)
+
+    def on_device_line(self, path, line):
+        if line == PasteStream.READY_SIGNAL:
+            # Pace pastes on the first device to become ready; the others
+            # are bounded by MAX_BACKLOG
+            with self.lock:
+                count = self.ready_counts.get(path, 0) + 1
+                self.ready_counts[path] = count
+                if count <= self.ready_forwarded:
+                    return
+                self.ready_forwarded = count
+        if self.line_callback:
+            self.line_callback(line)
+
+    def send_data(self, data, path=None, sample=None):
+        if not data:
+            return 0
+        queued = time.perf_counter()
+        encoded = {}
+        sent = 0
+        with self.lock:
+            self.resync_lagging()
+            for target, connection in self.connections.items():
+                if not connection.connected or (path and target != path):
+                    continue
+                repeat_runs = connection.repeat_runs()
+                frames = encoded.get(repeat_runs)
+                if frames is None:
+                    frames = encoded[repeat_runs] = transport.encode_frames(
+                        data, repeat_runs
+                    )
+                if target in self.lagging:
+                    connection.frames_dropped += len(frames)
+                    continue
+                if connection.queue_depth() + len(frames) > MAX_BACKLOG:
+                    connection.log.debug(f"{target} is lagging, skipping frames")
+                    self.lagging.add(target)
+                    connection.frames_dropped += len(frames)
+                    continue
+                connection.queue_frames(queued, frames, sample)
+                # Each key event is timed once, on the first device taking it
+                sample = None
+                sent = len(data)
+        return sent
+
+    def resync_lagging(self):
+        for path in list(self.lagging):
+            connection = self.connections[path]
+            if connection.queue_depth() or connection.writing:
+                continue
+            self.lagging.discard(path)
+            self.ready_counts[path] = self.ready_forwarded
+            if self.state and connection.connected:
+                state = self.state()
+                connection.queue_frames(
+                    time.perf_counter(),
+                    transport.encode_frames(state, connection.repeat_runs()),
+                )
+            connection.log.debug(f"{path} caught up")
+
+    def supports_ready(self):
+        return any(
+            connection.connected and connection.supports_ready()
+            for connection in list(self.connections.values())
+        )
+
+    def queue_depth(self):
+        depths = [
+            connection.queue_depth()
+            for path, connection in list(self.connections.items())
+            if connection.connected and path not in self.lagging
+        ]
+        return max(depths, default=0)
+
+    def drain(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for path, connection in list(self.connections.items()):
+            if path in self.lagging:
+                continue
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.monotonic(), 0)
+            if not connection.drain(remaining):
+                return False
+        return True
+
+    def read_lines(self):
+        lines = []
+        for connection in list(self.connections.values()):
+            lines.extend(connection.read_lines())
+        return lines
+
+    def dispatch_events(self):
+        for connection in list(self.connections.values()):
+            connection.dispatch_events()
+        if self.lagging:
+            with self.lock:
+                self.resync_lagging()
+
+    def connected_paths(self):
+        return [
+            path
+            for path, connection in list(self.connections.items())
+            if connection.connected
+        ]
+
+    def is_connected(self, path=None):
+        if path:
+            connection = self.connections.get(path)
+            return bool(connection and connection.connected)
+        return bool(self.connected_paths())
+
+    @property
+    def connection_path(self):
+        return ", ".join(self.connected_paths()) or None
+
+    def stats(self):
+        stats = {}
+        for path, connection in list(self.connections.items()):
+            stats[path] = connection.stats()
+            stats[path]["lagging"] = path in self.lagging
+        return stats
+
+    def close(self):
+        for connection in list(self.connections.values()):
+            connection.close()
+
+    def shutdown(self):
+        for path in list(self.connections):
+            self.remove(path)
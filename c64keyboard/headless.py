@@ -0,0 +1,156 @@
+import logging
+import sys
+import time
+from .fanout import ConnectionGroup
+from . import recording
+from .keyboard_logic import C64KeyboardLogic
+from .paste import PasteStream
+
+
+READ_SIZE = 4096  # characters
+MAX_TOKEN_LENGTH = 32
+CONNECT_TIMEOUT = 10  # seconds
+DRAIN_TIMEOUT = 30  # seconds
+REPLAY_QUEUE_LIMIT = 64  # frames
+
+
+def iter_text(stream, size=READ_SIZE):
+    pending = ""
+    while True:
+        text = stream.read(size)
+        if not text:
+            break
+        text = pending + text
+        # Keep a trailing, possibly incomplete {TOKEN} for the next read
+        start = text.rfind("{")
+        if (
+            start >= 0
+            and "}" not in text[start:]
+            and len(text) - start < MAX_TOKEN_LENGTH
+        ):
+            pending = text[start:]
+            text = text[:start]
+        else:
+            pending = ""
+        if text:
+            yield text
+    if pending:
+        yield pending
+
+
+def iter_chunks(logic, stream):
+    for text in iter_text(stream):
+        yield from logic.iter_encode_text(text)
+
+
+class HeadlessTyper:
+    def __init__(self, devices, c64_type="breadbin", lang=""):
+        self.log = logging.getLogger("c64keyboard")
+        self.logic = C64KeyboardLogic()
+        self.logic.load_config(c64_type, lang)
+        self.paste_stream = None
+        self.connection = ConnectionGroup(
+            line_callback=self.on_device_line, state=self.logic.full_state
+        )
+        for device in devices:
+            self.connection.add(device)
+
+    def on_device_line(self, line):
+        paste_stream = self.paste_stream
+        if paste_stream:
+            paste_stream.on_device_line(line)
+
+    def wait_connected(self, timeout=CONNECT_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        total = len(self.connection.connections)
+        while len(self.connection.connected_paths()) < total:
+            if time.monotonic() > deadline:
+                break
+            time.sleep(0.05)
+        for path, connection in self.connection.connections.items():
+            if not connection.is_connected():
+                self.log.warning(f"Cannot connect to {path}")
+        if not self.connection.is_connected():
+            return False
+        self.connection.send_data(self.logic.full_state())
+        return True
+
+    def type_stream(self, stream):
+        drain = None
+        if not self.connection.supports_ready():
+            drain = self.connection.drain
+        self.paste_stream = PasteStream(
+            iter_chunks(self.logic, stream), self.connection.send_data, drain=drain
+        )
+        start = time.monotonic()
+        self.paste_stream.start()
+        try:
+            while self.paste_stream.is_running():
+                self.paste_stream.done.wait(0.1)
+        except KeyboardInterrupt:
+            self.paste_stream.cancel()
+            raise
+        finally:
+            self.connection.drain(DRAIN_TIMEOUT)
+            elapsed = time.monotonic() - start
+            sent = self.paste_stream.sent
+            rate = sent / elapsed if elapsed > 0 else 0
+            self.log.info(
+                f"Typed {sent} characters in {elapsed:.2f} s, {rate:.1f} chars/sec"
+            )
+            self.log_stats()
+        return sent
+
+    def log_stats(self):
+        for path, stats in self.connection.stats().items():
+            self.log.info(
+                f"{path}: {stats['frames_written']} frames, "
+                f"{stats['bytes_written']} bytes written, "
+                f"{stats['frames_dropped']} dropped, "
+                f"{stats['disconnects']} disconnects"
+            )
+
+    def send_replayed(self, data):
+        while self.connection.queue_depth() > REPLAY_QUEUE_LIMIT:
+            time.sleep(0.001)
+        self.connection.send_data(data)
+
+    def replay(self, path, realtime=True):
+        start = time.monotonic()
+        count = recording.replay(
+            path,
+            lambda key, pressed: self.send_replayed(self.logic.key_event(key, pressed)),
+            lambda data: self.send_replayed(self.logic.update_matrix_state(data)),
+            realtime=realtime,
+        )
+        self.connection.drain(DRAIN_TIMEOUT)
+        elapsed = time.monotonic() - start
+        self.log.info(f"Replayed {count} events from {path} in {elapsed:.2f} s")
+        self.log_stats()
+        return count
+
+
+def run(devices, files, c64_type="breadbin", lang="", replay=None, realtime=True):
+    typer = HeadlessTyper(devices, c64_type, lang)
+    if not typer.wait_connected():
+        typer.log.error("Cannot connect to any device")
+        return 1
+
+    try:
+        if replay:
+            typer.replay(replay, realtime)
+            return 0
+        for path in files or ["-"]:
+            if path == "-":
+                typer.type_stream(sys.stdin)
+            else:
+                with open(path, encoding="utf-8") as f:
+                    typer.type_stream(f)
+    except KeyboardInterrupt:
+        return 130
+    except recording.RecordingError as e:
+        typer.log.error(e)
+        return 1
+    finally:
+        typer.connection.shutdown()
+    return 0
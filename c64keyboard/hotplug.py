@@ -0,0 +1,67 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import sys
+import time
+
+
+DEVICE_DIR = "/dev"
+POLL_INTERVAL = 1  # seconds
+
+IN_ATTRIB = 0x00000004
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+class PollingWatcher:
+    polling = True
+
+    def wait(self, timeout=None):
+        time.sleep(POLL_INTERVAL)
+        return True
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    polling = False
+
+    def __init__(self, path=DEVICE_DIR):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CREATE | IN_DELETE | IN_ATTRIB
+        if libc.inotify_add_watch(self.fd, path.encode(), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"Cannot watch {path}")
+
+    def wait(self, timeout=None):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+def create_watcher():
+    log = logging.getLogger("SerialConnection")
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError) as e:
+            log.debug(f"Hotplug detection unavailable, polling instead: {e}")
+    return PollingWatcher()
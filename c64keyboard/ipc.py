@@ -0,0 +1,302 @@
+import argparse
+import json
+import logging
+import os
+import selectors
+import socket
+import struct
+import sys
+import threading
+from . import protocol
+from . import recording
+from . import resources
+
+
+KEY_PRESS = recording.KEY_PRESS
+KEY_RELEASE = recording.KEY_RELEASE
+MATRIX = recording.MATRIX
+TOKEN = 4
+TEXT = 5
+KINDS = (KEY_PRESS, KEY_RELEASE, MATRIX, TOKEN, TEXT)
+
+# Binary commands: kind, payload length, payload. JSON commands are one
+# object or list per line and are told apart by their first byte.
+COMMAND = struct.Struct("<BH")
+JSON_START = b"{["
+MAX_LINE = 1 << 20  # bytes
+READ_SIZE = 65536
+SELECT_TIMEOUT = 0.5  # seconds
+
+
+class IpcError(Exception):
+    pass
+
+
+def default_socket_path():
+    return resources.runtime_path("ipc.sock")
+
+
+def encode_command(kind, payload):
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    return COMMAND.pack(kind, len(payload)) + payload
+
+
+def check_matrix(values):
+    # REPEAT is a wire opcode, never a key
+    if protocol.REPEAT in values:
+        raise IpcError("Matrix values must not contain the REPEAT opcode")
+    return values
+
+
+def string_field(command, name):
+    value = command[name]
+    if not isinstance(value, str):
+        raise IpcError(f"{name} must be a string")
+    return value
+
+
+def parse_json_command(command):
+    if "key" in command:
+        key = string_field(command, "key")
+        pressed = command.get("pressed")
+        if pressed is None:
+            return [(KEY_PRESS, key), (KEY_RELEASE, key)]
+        if not isinstance(pressed, bool):
+            raise IpcError("pressed must be true or false")
+        return [(KEY_PRESS if pressed else KEY_RELEASE, key)]
+    if "token" in command:
+        return [(TOKEN, string_field(command, "token").strip("{}"))]
+    if "text" in command:
+        return [(TEXT, string_field(command, "text"))]
+    if "matrix" in command:
+        values = command["matrix"]
+        if not isinstance(values, list) or not all(
+            type(value) is int and 0 <= value <= 0xFF for value in values
+        ):
+            raise IpcError("matrix must be a list of byte values")
+        return [(MATRIX, check_matrix(bytes(values)))]
+    if "commands" in command:
+        return parse_json_commands(command["commands"])
+    raise IpcError(f"Unknown command {command}")
+
+
+def parse_json_commands(message):
+    if isinstance(message, dict):
+        return parse_json_command(message)
+    if not isinstance(message, list):
+        raise IpcError("Expected a JSON object or list")
+    commands = []
+    for command in message:
+        if not isinstance(command, dict):
+            raise IpcError("Expected a JSON object")
+        commands.extend(parse_json_command(command))
+    return commands
+
+
+class IpcClient:
+    def __init__(self, sock):
+        self.sock = sock
+        self.received = bytearray()
+        self.pending = bytearray()
+
+    def parse(self):
+        commands = []
+        replies = []
+        buffer = self.received
+        while buffer:
+            if buffer[0] in JSON_START:
+                end = buffer.find(b"\n")
+                if end < 0:
+                    if len(buffer) > MAX_LINE:
+                        raise IpcError("JSON command too long")
+                    break
+                line = bytes(buffer[:end])
+                del buffer[: end + 1]
+                try:
+                    commands.extend(parse_json_commands(json.loads(line)))
+                    replies.append({"ok": True})
+                except (ValueError, TypeError, KeyError, IpcError) as e:
+                    replies.append({"error": str(e)})
+            elif buffer[0] in b"\r\n":
+                del buffer[:1]
+            elif buffer[0] in KINDS:
+                if len(buffer) < COMMAND.size:
+                    break
+                kind, length = COMMAND.unpack_from(buffer)
+                end = COMMAND.size + length
+                if len(buffer) < end:
+                    break
+                payload = bytes(buffer[COMMAND.size : end])
+                del buffer[:end]
+                if kind == MATRIX:
+                    payload = check_matrix(payload)
+                else:
+                    try:
+                        payload = payload.decode("utf-8")
+                    except UnicodeDecodeError:
+                        raise IpcError("Command payload is not valid UTF-8")
+                commands.append((kind, payload))
+            else:
+                raise IpcError(f"Unknown command kind {buffer[0]}")
+        return commands, replies
+
+
+# on_commands is called on the server thread with one batch per client read
+class IpcServer:
+    def __init__(self, on_commands, path=None):
+        self.log = logging.getLogger("c64keyboard")
+        self.on_commands = on_commands
+        self.path = path or default_socket_path()
+        self.selector = selectors.DefaultSelector()
+        self.server = None
+        self.clients = {}
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except OSError:
+                os.remove(self.path)
+            else:
+                raise OSError(f"{self.path} is used by another emulator")
+            finally:
+                probe.close()
+
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self.server.listen()
+        self.server.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ)
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        self.log.debug(f"Accepting key commands on {self.path}")
+        return self.path
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        for client in list(self.clients.values()):
+            self.drop(client)
+        if self.server:
+            self.selector.unregister(self.server)
+            self.server.close()
+            self.server = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def run(self):
+        while self.running:
+            for key, events in self.selector.select(SELECT_TIMEOUT):
+                if key.fileobj is self.server:
+                    self.accept()
+                    continue
+                client = key.data
+                try:
+                    if events & selectors.EVENT_READ:
+                        self.receive(client)
+                    if events & selectors.EVENT_WRITE:
+                        self.flush(client)
+                except (OSError, IpcError) as e:
+                    self.log.debug(f"Dropping IPC client: {e}")
+                    self.drop(client)
+
+    def accept(self):
+        try:
+            sock, _ = self.server.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        client = IpcClient(sock)
+        self.clients[sock] = client
+        self.selector.register(sock, selectors.EVENT_READ, client)
+
+    def drop(self, client):
+        self.clients.pop(client.sock, None)
+        self.selector.unregister(client.sock)
+        client.sock.close()
+
+    def receive(self, client):
+        data = client.sock.recv(READ_SIZE)
+        if not data:
+            raise IpcError("client closed the connection")
+        client.received += data
+        commands, replies = client.parse()
+        if commands:
+            self.on_commands(commands)
+        if replies:
+            for reply in replies:
+                client.pending += json.dumps(reply).encode() + b"\n"
+            self.flush(client)
+
+    def flush(self, client):
+        if client.pending:
+            try:
+                sent = client.sock.send(client.pending)
+                del client.pending[:sent]
+            except BlockingIOError:
+                pass
+        events = selectors.EVENT_READ
+        if client.pending:
+            events |= selectors.EVENT_WRITE
+        self.selector.modify(client.sock, events, client)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Send key commands to a running C64 keyboard emulator"
+    )
+    parser.add_argument("-s", "--socket", default=default_socket_path())
+    # All options append to one list so commands are sent in the given order
+    parser.add_argument(
+        "-k",
+        "--key",
+        dest="commands",
+        action="append",
+        type=lambda key: {"key": key},
+        help="tap a key",
+    )
+    parser.add_argument(
+        "-t",
+        "--token",
+        dest="commands",
+        action="append",
+        type=lambda token: {"token": token},
+        help="type a token such as RETURN",
+    )
+    parser.add_argument(
+        "-x",
+        "--text",
+        dest="commands",
+        action="append",
+        type=lambda text: {"text": text},
+        help="text to type, - for stdin",
+    )
+    args = parser.parse_args()
+    if not args.commands:
+        parser.error("nothing to send")
+
+    commands = args.commands
+    for command in commands:
+        if command.get("text") == "-":
+            command["text"] = sys.stdin.read()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(args.socket)
+        sock.sendall(json.dumps(commands).encode() + b"\n")
+        reply = json.loads(sock.makefile().readline())
+    if "error" in reply:
+        print(reply["error"], file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,15 @@
 # -*- coding: utf-8 -*-
 
 import tkinter as tk
-from PIL import ImageTk, Image
-from . import connection
+from . import resources
 from .keyboard_logic import C64KeyboardLogic
-import serial
-import serial.tools.list_ports
+from .paste import PasteStream
+from . import recording
+from . import trace
+import collections
+import queue
 import sys
+import threading
 import time
 import logging
 
@@ -16,9 +19,17 @@ class C64KeyboardEmulator:
     WINDOW_TITLE_CONNECTED = "C64 Keyboard, {layout} layout - Connected {connected}"
     WINDOW_TITLE = "C64 Keyboard, {layout} layout - Disconnected"
     WINDOW_GEOMETRY = "1006x290"
-    IMAGE_PATH = "images"
+    IMAGE_PATH = resources.data_path("images")
     KEYBOARD_IMAGE_PATH = IMAGE_PATH + "/{c64_type}_keyboard{lang}.png"
     KEY_IMAGE_PATH = IMAGE_PATH + "/keys/{key}"
+    CANCEL_PASTE_LABEL = "Cancel paste"
+    CANCEL_PASTE_LABEL_INDEX = 1
+    PASTE_PROGRESS_INTERVAL = 100  # milliseconds
+    READ_INPUT_INTERVAL = 16  # milliseconds
+    RECORDING_EXTENSION = ".c64k"
+    REPLAY_QUEUE_SIZE = 256
+    REDRAW_INTERVAL = 16  # milliseconds
+    LATENCY_REFRESH_INTERVAL = 500  # milliseconds
 
     def __init__(self):
         self.logic = C64KeyboardLogic()
@@ -28,6 +39,22 @@ class C64KeyboardEmulator:
         self.window = None
         self.canvas = None
         self.key_imgages = {}
+        self.edit_menu = None
+        self.paste_stream = None
+        self.redraw_pending = False
+        self.drawn_state = 0
+        self.bg_id = None
+        self.sprites = {}
+        self.recorder = None
+        self.replay_cancelled = None
+        self.replay_queue = queue.Queue(maxsize=self.REPLAY_QUEUE_SIZE)
+        self.decoded_images = {}
+        self.ipc_server = None
+        self.ipc_queue = queue.Queue()
+        self.ipc_commands = collections.deque()
+        self.tracker = None
+        self.latency_window = None
+        self.latency_labels = {}
 
     def decode_key(self, event):
         # self.log.debug(f"event: {event}")
@@ -42,67 +69,247 @@ class C64KeyboardEmulator:
         return key
 
     def on_key_event(self, event, pressed):
+        start = time.perf_counter() if self.tracker else None
         key = self.decode_key(event)
-        # self.log.debug(f"Key {'pressed' if pressed else 'released'}: {key}")
-        self.send_key(key, pressed)
-
-    def send_key(self, key, pressed):
-        values = self.logic.translate_key(key, pressed)
-        if values:
-            self.connection.send_data(values)
-            for val in values:
-                img = self.key_imgages.get(val & 0x7F, None)
-                if img:
-                    s = "normal" if val & 0x80 else "hidden"
-                    self.canvas.itemconfig(img["id"], state=s)
-                if val & 0xC3 or val & 0x44:
-                    for img in self.key_imgages.values():
-                        self.canvas.itemconfig(img["id"], state="hidden")
-                # time.sleep(0.5)
-
-            self.log.debug("------------ Sent-----------------------")
+        if trace.enabled:
+            trace.record(trace.KEY_EVENT, pressed, key)
+        self.send_key(key, pressed, start)
+
+    def send_key(self, key, pressed, start=None):
+        if self.recorder:
+            self.recorder.record_key(key, pressed)
+        values = self.logic.key_event(key, pressed)
+        if values and self.connection:
+            sample = self.tracker.sample(start) if start else None
+            self.connection.send_data(values, sample=sample)
+            self.schedule_redraw()
+            if trace.enabled:
+                trace.record(trace.SEND, len(values), values)
+
+    def send_matrix(self, data):
+        if self.recorder:
+            self.recorder.record_matrix(data)
+        if self.connection:
+            self.connection.send_data(self.logic.update_matrix_state(data))
+            self.schedule_redraw()
+
+    def schedule_redraw(self):
+        if not self.redraw_pending:
+            self.redraw_pending = True
+            self.window.after(self.REDRAW_INTERVAL, self.redraw_keys)
+
+    def redraw_keys(self):
+        self.redraw_pending = False
+        if self.paste_stream and self.paste_stream.is_running():
+            return
+
+        state = self.logic.key_state()
+        changed = state ^ self.drawn_state
+        while changed:
+            pos = (changed & -changed).bit_length() - 1
+            changed &= changed - 1
+            img = self.key_imgages.get(pos)
+            if img:
+                s = "normal" if state >> pos & 1 else "hidden"
+                self.canvas.itemconfig(img["id"], state=s)
+        self.drawn_state = state
+
+    def on_device_line(self, line):
+        paste_stream = self.paste_stream
+        if paste_stream:
+            paste_stream.on_device_line(line)
 
     def read_input(self):
-        if self.connection and self.connection.is_connected():
-            while True:
-                line = self.connection.readline()
-                if line and len(line.strip()) > 0:
-                    data = line.decode("utf-8").strip()
-                    self.log.debug(f" --> {data}")
-                else:
-                    break
+        try:
+            if self.connection:
+                self.connection.dispatch_events()
+                for line in self.connection.read_lines():
+                    self.log.debug(f" --> {line}")
+            self.process_replay()
+            self.process_ipc()
+        finally:
+            # Keep polling even if one pass failed
+            self.window.after(self.READ_INPUT_INTERVAL, self.read_input)
+
+    def start_recording(self):
+        from tkinter import filedialog
+
+        path = filedialog.asksaveasfilename(
+            title="Record keys",
+            defaultextension=self.RECORDING_EXTENSION,
+            filetypes=[("Key recordings", f"*{self.RECORDING_EXTENSION}")],
+        )
+        if not path:
+            return
+        self.stop_recording()
+        self.recorder = recording.EventRecorder(path)
+        self.log.debug(f"Recording keys to {path}")
+
+    def stop_recording(self):
+        if self.recorder:
+            self.log.debug(f"Recorded {self.recorder.count} events")
+            self.recorder.close()
+            self.recorder = None
+
+    def start_replay(self):
+        from tkinter import filedialog
+
+        path = filedialog.askopenfilename(
+            title="Replay keys",
+            filetypes=[("Key recordings", f"*{self.RECORDING_EXTENSION}")],
+        )
+        if not path:
+            return
+        self.stop_replay()
+        self.replay_cancelled = threading.Event()
+        replay_thread = threading.Thread(
+            target=self.replay, args=(path, self.replay_cancelled)
+        )
+        replay_thread.daemon = True
+        replay_thread.start()
+
+    def stop_replay(self):
+        if self.replay_cancelled:
+            self.replay_cancelled.set()
+
+    def replay(self, path, cancelled):
+        def put(item):
+            while not cancelled.is_set():
+                try:
+                    self.replay_queue.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        try:
+            count = recording.replay(
+                path,
+                lambda key, pressed: put((key, pressed)),
+                put,
+                cancelled=cancelled,
+            )
+            self.log.debug(f"Replayed {count} events from {path}")
+        except (OSError, recording.RecordingError) as e:
+            self.log.debug(f"Cannot replay {path}: {e}")
+
+    def process_replay(self):
+        while True:
+            try:
+                item = self.replay_queue.get_nowait()
+            except queue.Empty:
+                return
+            if isinstance(item, tuple):
+                self.send_key(*item)
+            else:
+                self.send_matrix(item)
+
+    def start_ipc(self, path=None):
+        from . import ipc
 
-        self.window.after(200, self.read_input)
+        try:
+            self.ipc_server = ipc.IpcServer(self.ipc_queue.put, path)
+            self.ipc_server.start()
+        except OSError as e:
+            self.ipc_server = None
+            self.log.error(f"Cannot accept key commands: {e}")
+
+    def stop_ipc(self):
+        if self.ipc_server:
+            self.ipc_server.stop()
+            self.ipc_server = None
+
+    def process_ipc(self):
+        while True:
+            try:
+                self.ipc_commands.extend(self.ipc_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        # Commands run in order, so everything after a text block waits until
+        # it has been typed instead of cancelling or overtaking it
+        while self.ipc_commands and not (
+            self.paste_stream and self.paste_stream.is_running()
+        ):
+            kind, payload = self.ipc_commands.popleft()
+            try:
+                self.process_ipc_command(kind, payload)
+            except Exception as e:
+                self.log.error(f"Cannot process key command {kind}: {e}")
+
+    def process_ipc_command(self, kind, payload):
+        from .ipc import KEY_PRESS, KEY_RELEASE, MATRIX, TEXT, TOKEN
+
+        if kind in (KEY_PRESS, KEY_RELEASE):
+            self.send_key(payload, kind == KEY_PRESS)
+        elif kind == MATRIX:
+            self.send_matrix(payload)
+        else:
+            # Adjacent text and tokens are typed as one paste
+            text = [payload if kind == TEXT else f"{{{payload}}}"]
+            while self.ipc_commands and self.ipc_commands[0][0] in (TEXT, TOKEN):
+                kind, payload = self.ipc_commands.popleft()
+                text.append(payload if kind == TEXT else f"{{{payload}}}")
+            self.type_text("".join(text))
 
     def handle_focus(self, event):
         if event.widget == self.window:
             if self.connection and self.logic:
-                data = self.logic.parse_key_combination("RESET_MATRIX")
-                self.connection.send_data(data)
+                self.connection.send_data(self.logic.full_state())
+                self.schedule_redraw()
+
+    def handle_focus_out(self, event):
+        if event.widget == self.window:
+            if self.connection and self.logic:
+                self.connection.send_data(self.logic.release_all())
+                self.schedule_redraw()
 
     def paste(self, event=None):
         text = self.window.clipboard_get()
-        self.log.debug(f"Pasting: {text}")
-        # self.log.info(f"----------------------------")
-        n = 100
-        for t in list(text[i : i + n] for i in range(0, len(text), n)):
-            # self.log.info(f"sending part: '{t}'  {len(t)}")
-            # self.log.info(f"----------------------------")
-            data = self.logic.trasnslate_key_combination(f"{self.logic.LINE_PREFIX}{t}")
-            self.connection.send_data(data)
+        self.log.debug(f"Pasting {len(text)} characters")
+        self.type_text(text)
+
+    def type_text(self, text):
+        # update_paste_progress keeps polling until it clears paste_stream
+        polling = self.paste_stream is not None
+        if polling:
+            self.paste_stream.cancel()
+
+        drain = None
+        if not self.connection.supports_ready():
+            drain = self.connection.drain
+        self.paste_stream = PasteStream(
+            self.logic.iter_encode_text(text),
+            self.connection.send_data,
+            total=len(text),
+            drain=drain,
+        )
+        self.paste_stream.start()
+        self.edit_menu.entryconfig(self.CANCEL_PASTE_LABEL_INDEX, state=tk.NORMAL)
+        if not polling:
+            self.update_paste_progress()
+
+    def cancel_paste(self):
+        if self.paste_stream:
+            self.paste_stream.cancel()
+
+    def update_paste_progress(self):
+        index = self.CANCEL_PASTE_LABEL_INDEX
+        if self.paste_stream and self.paste_stream.is_running():
+            progress = int(self.paste_stream.progress() * 100)
+            self.edit_menu.entryconfig(
+                index, label=f"{self.CANCEL_PASTE_LABEL} ({progress}%)"
+            )
+            self.window.after(self.PASTE_PROGRESS_INTERVAL, self.update_paste_progress)
+        else:
+            self.paste_stream = None
+            self.edit_menu.entryconfig(
+                index, label=self.CANCEL_PASTE_LABEL, state=tk.DISABLED
+            )
+            self.schedule_redraw()
 
     def donothing(self):
         pass
 
-    def create_debug_console_handler(self):
-        console_handler = logging.StreamHandler()
-        console_handler.setLevel(logging.DEBUG)
-        formatter = logging.Formatter(
-            "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-        )
-        console_handler.setFormatter(formatter)
-        return console_handler
-
     def on_hover(self, event):
         print(f"Hovering over: {event}")
 
@@ -116,6 +323,7 @@ class C64KeyboardEmulator:
             "<KeyRelease>", lambda e: self.on_key_event(e, False), add=True
         )
         self.window.bind("<FocusIn>", self.handle_focus)
+        self.window.bind("<FocusOut>", self.handle_focus_out)
 
         self.window.bind_class("SerialConnection", self.populate_serial_menu)
 
@@ -124,12 +332,22 @@ class C64KeyboardEmulator:
         filemenu.add_command(label="Open", command=self.donothing)
         filemenu.add_command(label="Configure", command=self.donothing)
         filemenu.add_separator()
+        filemenu.add_command(label="Start recording", command=self.start_recording)
+        filemenu.add_command(label="Stop recording", command=self.stop_recording)
+        filemenu.add_command(label="Replay", command=self.start_replay)
+        filemenu.add_command(label="Stop replay", command=self.stop_replay)
+        filemenu.add_separator()
         filemenu.add_command(label="Exit", command=self.window.quit)
         menubar.add_cascade(label="File", menu=filemenu)
 
-        helpmenu = tk.Menu(menubar, tearoff=0)
-        helpmenu.add_command(label="Paste", command=self.paste, accelerator="Ctrl+V")
-        menubar.add_cascade(label="Edit", menu=helpmenu)
+        self.edit_menu = tk.Menu(menubar, tearoff=0)
+        self.edit_menu.add_command(
+            label="Paste", command=self.paste, accelerator="Ctrl+V"
+        )
+        self.edit_menu.add_command(
+            label=self.CANCEL_PASTE_LABEL, command=self.cancel_paste, state=tk.DISABLED
+        )
+        menubar.add_cascade(label="Edit", menu=self.edit_menu)
 
         layoutmenu = tk.Menu(menubar, tearoff=0)
         self.populate_layout_menu(layoutmenu)
@@ -139,7 +357,17 @@ class C64KeyboardEmulator:
         serial_menu = tk.Menu(connections_menu, tearoff=0)
 
         connections_menu.add_cascade(label="Serial", menu=serial_menu)
-        connections_menu.add_command(label="Network", command=self.donothing)
+        connections_menu.add_command(label="Network", command=self.connect_network)
+        connections_menu.add_separator()
+        connections_menu.add_command(
+            label="Device statistics", command=self.show_device_stats
+        )
+        connections_menu.add_command(
+            label="Latency statistics", command=self.show_latency_stats
+        )
+        connections_menu.add_command(
+            label="Disconnect all", command=self.disconnect_all
+        )
         menubar.add_cascade(label="Connections", menu=connections_menu)
 
         connections_menu.bind(
@@ -148,23 +376,63 @@ class C64KeyboardEmulator:
         self.window.config(menu=menubar)
 
         self.canvas = tk.Canvas(self.window, height=290, width=1006)
-
-        self.set_bg_image()
         self.canvas.pack()
 
         self.window.bind_all("<Control-v>", self.paste)
 
+        self.window.update()
+
+    def load_images(self):
+        self.set_bg_image()
         self.load_keyboard_layout()
 
-        self.window.update()
+        prewarm_thread = threading.Thread(
+            target=self.prewarm_sprites, args=(self.logic.get_key_layouts(),)
+        )
+        prewarm_thread.daemon = True
+        prewarm_thread.start()
 
     def set_bg_image(self):
         bg_image_path = self.logic.create_path(self.KEYBOARD_IMAGE_PATH)
         self.log.debug(f"Loading background image {bg_image_path}")
-        self.bgImg = ImageTk.PhotoImage(Image.open(bg_image_path))
-        self.canvas.create_image(0, 0, anchor=tk.NW, image=self.bgImg)
+        self.bgImg = self.get_sprite(bg_image_path)
+        if self.bg_id is None:
+            self.bg_id = self.canvas.create_image(0, 0, anchor=tk.NW, image=self.bgImg)
+        else:
+            self.canvas.itemconfig(self.bg_id, image=self.bgImg)
+
+    def get_sprite(self, path):
+        from PIL import Image, ImageTk
+
+        sprite = self.sprites.get(path)
+        if sprite is None:
+            image = self.decoded_images.pop(path, None) or Image.open(path)
+            sprite = ImageTk.PhotoImage(image)
+            self.sprites[path] = sprite
+        return sprite
+
+    def prewarm_sprites(self, layouts):
+        from PIL import Image
+
+        for c64_type, lang, _ in layouts:
+            paths = [self.logic.create_path(self.KEYBOARD_IMAGE_PATH, c64_type, lang)]
+            for key in self.logic.get_key_layout(c64_type, lang):
+                paths.append(self.KEY_IMAGE_PATH.format(key=key["filename"]))
+            for path in paths:
+                if path in self.sprites or path in self.decoded_images:
+                    continue
+                try:
+                    image = Image.open(path)
+                    image.load()
+                except OSError as e:
+                    self.log.debug(f"Cannot preload {path}: {e}")
+                    continue
+                self.decoded_images[path] = image
+        self.log.debug(f"Preloaded {len(self.decoded_images)} images")
 
     def populate_serial_menu(self, serial_menu, event):
+        import serial.tools.list_ports
+
         serial_menu.delete(0, tk.END)
         ports = serial.tools.list_ports.comports()
         for port in ports:
@@ -172,17 +440,121 @@ class C64KeyboardEmulator:
                 label=port.device,
                 command=lambda p=port.device: self.connect_serial(p),
             )
-        if self.connection and self.connection.is_connected():
+        if self.connection:
             for index, port in enumerate(ports):
-                if port.device == self.connection.connection_path:
+                if self.connection.is_connected(port.device):
                     serial_menu.entryconfig(index, label=f"{port.device} ✔")
 
     def connect_serial(self, port):
         try:
-            self.log.debug(f"Setting serial port {port}")
-            self.connection.set_serial(port)
+            if port in self.connection.connections:
+                self.log.debug(f"Removing serial port {port}")
+                self.connection.remove(port)
+            else:
+                self.log.debug(f"Adding serial port {port}")
+                self.connection.add(port)
         except Exception as e:
             self.log.debug(f"Failed to connect to {port}. Error: {e}")
+        self.update_window_title()
+
+    def connect_network(self):
+        from tkinter import simpledialog
+
+        address = simpledialog.askstring(
+            "Network",
+            "Device address (tcp://host:port or udp://host:port)",
+            initialvalue="tcp://",
+            parent=self.window,
+        )
+        if not address:
+            return
+        try:
+            self.log.debug(f"Adding network address {address}")
+            self.connection.add(address)
+        except Exception as e:
+            self.log.debug(f"Failed to connect to {address}. Error: {e}")
+
+    def enable_latency_tracking(self, dump_path=None):
+        from .latency import LatencyTracker
+
+        if not self.tracker:
+            self.tracker = LatencyTracker()
+            if self.connection:
+                self.connection.set_tracker(self.tracker)
+        if dump_path:
+            self.tracker.start_dump(dump_path)
+            self.log.debug(f"Writing latency statistics to {dump_path}")
+
+    def show_latency_stats(self):
+        from .latency import STAGES
+
+        self.enable_latency_tracking()
+        if self.latency_window:
+            self.latency_window.lift()
+            return
+
+        self.latency_window = tk.Toplevel(self.window)
+        self.latency_window.title("Latency")
+        self.latency_window.resizable(False, False)
+        self.latency_window.protocol("WM_DELETE_WINDOW", self.close_latency_stats)
+        headings = ("Stage", "Count", "p50 ms", "p99 ms", "Max ms")
+        for column, heading in enumerate(headings):
+            tk.Label(self.latency_window, text=heading, padx=8).grid(
+                row=0, column=column
+            )
+        self.latency_labels = {}
+        for row, stage in enumerate(STAGES, start=1):
+            tk.Label(self.latency_window, text=stage, padx=8).grid(
+                row=row, column=0, sticky=tk.W
+            )
+            labels = []
+            for column in range(1, len(headings)):
+                label = tk.Label(self.latency_window, padx=8)
+                label.grid(row=row, column=column, sticky=tk.E)
+                labels.append(label)
+            self.latency_labels[stage] = labels
+        self.update_latency_stats()
+
+    def update_latency_stats(self):
+        if not self.latency_window:
+            return
+        for stage, summary in self.tracker.summary().items():
+            count, p50, p99, maximum = self.latency_labels[stage]
+            count.config(text=summary["count"])
+            p50.config(text=f"{summary['p50']:.2f}")
+            p99.config(text=f"{summary['p99']:.2f}")
+            maximum.config(text=f"{summary['max']:.2f}")
+        self.window.after(self.LATENCY_REFRESH_INTERVAL, self.update_latency_stats)
+
+    def close_latency_stats(self):
+        self.latency_window.destroy()
+        self.latency_window = None
+
+    def disconnect_all(self):
+        self.connection.shutdown()
+        self.update_window_title()
+
+    def show_device_stats(self):
+        from tkinter import messagebox
+
+        lines = []
+        for path, stats in self.connection.stats().items():
+            status = "connected" if stats["connected"] else "disconnected"
+            if stats["lagging"]:
+                status += ", lagging"
+            lines.append(
+                f"{path} ({status})\n"
+                f"  {stats['frames_written']} frames, "
+                f"{stats['bytes_written']} bytes written, "
+                f"{stats['frames_dropped']} dropped\n"
+                f"  {stats['connects']} connects, "
+                f"{stats['disconnects']} disconnects, "
+                f"{stats['queue_depth']} queued, "
+                f"max write latency {stats['max_write_latency'] * 1000:.1f} ms"
+            )
+        messagebox.showinfo(
+            "Device statistics", "\n\n".join(lines) or "No devices", parent=self.window
+        )
 
     def populate_layout_menu(self, layoutmenu):
         layouts = self.logic.get_key_layouts()
@@ -196,14 +568,24 @@ class C64KeyboardEmulator:
 
     def load_keyboard_layout(self):
         key_layout = self.logic.get_key_layout()
+        items = [img["id"] for img in self.key_imgages.values()]
         self.key_imgages = {}
         for key in key_layout:
             key_path = self.KEY_IMAGE_PATH.format(key=key["filename"])
-            img = ImageTk.PhotoImage(Image.open(key_path))
-            id = self.canvas.create_image(
-                key["x"], key["y"], anchor=tk.NW, image=img, state="hidden"
-            )
+            img = self.get_sprite(key_path)
+            if items:
+                id = items.pop()
+                self.canvas.coords(id, key["x"], key["y"])
+                self.canvas.itemconfig(id, image=img, state="hidden")
+            else:
+                id = self.canvas.create_image(
+                    key["x"], key["y"], anchor=tk.NW, image=img, state="hidden"
+                )
             self.key_imgages[key["matrix_pos"]] = {"img": img, "id": id}
+        for id in items:
+            self.canvas.delete(id)
+        self.drawn_state = 0
+        self.schedule_redraw()
 
     def change_layout(self, c64_type, lang):
         self.logic.load_config(c64_type, lang)
@@ -222,33 +604,59 @@ class C64KeyboardEmulator:
             self.window.title(self.WINDOW_TITLE.format(layout=self.logic.layout))
 
     def connection_callback(self, event):
+        from . import transport
+
         # print(f"Event: {event}")
         self.update_window_title()
         if self.connection and self.logic:
-            if event["type"] == "connected":
-                data = self.logic.parse_key_combination("RESET_MATRIX")
-                self.connection.send_data(data)
-
-    def run(self):
-        self.log.addHandler(self.create_debug_console_handler())
-        self.log.setLevel(logging.DEBUG)
+            if event.type == transport.CONNECTED:
+                self.connection.send_data(self.logic.full_state(), event.path)
+                self.schedule_redraw()
 
-        try:
-            self.connection = connection.SerialConnection(callback=self.connection_callback)
-        except Exception as e:
-            self.log.debug(f"Cannot open serial device, exiting. Error: {e}")
-            sys.exit()
-        # time.sleep(1)
+    def start(self, devices=None):
+        from .fanout import ConnectionGroup
 
-        self.logic.load_config()
+        self.connection = ConnectionGroup(
+            callback=self.connection_callback,
+            line_callback=self.on_device_line,
+            state=self.logic.full_state,
+        )
+        self.connection.set_tracker(self.tracker)
+        for device in devices or []:
+            try:
+                self.connection.add(device)
+            except Exception as e:
+                self.log.debug(f"Cannot open {device}. Error: {e}")
+        self.load_images()
+
+    def run(
+        self,
+        devices=None,
+        ipc_path=None,
+        latency_path=None,
+        c64_type="breadbin",
+        lang="",
+    ):
+        self.logic.load_config(c64_type, lang)
+        if latency_path:
+            self.enable_latency_tracking(latency_path)
         self.initialize_gui()
 
+        self.window.after_idle(self.start, devices)
+        if ipc_path is not None:
+            self.window.after_idle(self.start_ipc, ipc_path or None)
         self.window.after(20, self.read_input)
         self.window.mainloop()
+        if latency_path:
+            self.tracker.stop_dump()
+            self.tracker.dump(latency_path)
+        self.stop_ipc()
+        self.stop_recording()
         self.log.debug("Exiting...")
         sys.exit()
 
 
 if __name__ == "__main__":
-    emulator = C64KeyboardEmulator()
-    emulator.run()
+    from .cli import main
+
+    main()
@@ -1,8 +1,19 @@
 import json
 import logging
+import marshal
 import os
 import re
 import time
+from . import resources
+from . import trace
+
+
+_NOT_COMPILED = object()
+
+
+class _TextTable(dict):
+    def __missing__(self, key):
+        return None
 
 
 class C64KeyboardLogic:
@@ -10,12 +21,28 @@ class C64KeyboardLogic:
     LOAD_8 = LINE_PREFIX + "load" + ("{CURSOR_RIGHT}") * 19 + ",8:{RETURN}"
     LOAD_DIR = LINE_PREFIX + 'load"$",8:{RETURN}'
 
-    CONFIG_PATH = "config"
+    CONFIG_PATH = resources.data_path("config")
     KEY_CONFIG_PATH = "{config_path}/key_config.json"
     KEYBOARD_LAYOUT_PATH = "{config_path}/keyboard_layout"
     KEYBOARD_LAYOUT_FILE_PATH = KEYBOARD_LAYOUT_PATH + "/{c64_type}{lang}.json"
+    # Kept in the cache directory, the installed package may be read-only
+    LAYOUT_INDEX_PATH = os.path.join(resources.cache_dir(), "keyboard_layouts.json")
+    LAYOUT_INDEX_VERSION = 1
+    COMPILED_CONFIG_VERSION = 1
     KEYBOARD_MATRIX_PATH = "{config_path}/keyboard_matrix{lang}.json"
-    IMAGE_PATH = "images/{c64_type}_keyboard{lang}.png"
+    IMAGE_PATH = resources.data_path("images", "{c64_type}_keyboard{lang}.png")
+
+    TOKEN_PATTERN = re.compile(r"\{(\w+)\}")
+    TEXT_REPLACEMENTS = {
+        "\n": "RETURN",
+        " ": "SPACE",
+        "|": "UP_ARROW",
+        "_": "LEFT_ARROW",
+    }
+    SHIFTED_CHARACTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZÅÄÖ"
+
+    MATRIX_SIZE = 64
+    STATE_SPECIAL_KEYS = ("RESTORE", "SHIFT_LOCK")
 
     def __init__(self):
         self.log = logging.getLogger("c64keyboard")
@@ -27,33 +54,82 @@ class C64KeyboardLogic:
         self.c64_type = "breadbin"
         self.lang = ""
         self.key_layout = {}
+        self.key_table = {}
+        self.text_table = _TextTable()
+        self.token_table = {}
+        self.compiled_configs = {}
+        self.matrix_state = 0
+        self.special_state = 0
 
-    def create_path(self, path):
+    def create_path(self, path, c64_type=None, lang=None):
+        c64_type = self.c64_type if c64_type is None else c64_type
+        lang = self.lang if lang is None else lang
         return path.format(
             config_path=self.CONFIG_PATH,
-            c64_type=self.c64_type,
-            lang=f"_{self.lang}" if self.lang and not self.lang == "en" else "",
+            c64_type=c64_type,
+            lang=f"_{lang}" if lang and not lang == "en" else "",
         )
 
+    def load_layout_index(self, index_path):
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if index.get("version") != self.LAYOUT_INDEX_VERSION:
+            return {}
+        return index.get("layouts", {})
+
+    def save_layout_index(self, index_path, layouts):
+        try:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            with open(index_path, "w") as f:
+                index = {"version": self.LAYOUT_INDEX_VERSION, "layouts": layouts}
+                json.dump(index, f)
+        except OSError as e:
+            self.log.debug(f"Cannot write layout index {index_path}: {e}")
+
     def get_key_layouts(self):
-        layout_info = []
         config_dir = self.create_path(self.KEYBOARD_LAYOUT_PATH)
-        for filename in os.listdir(config_dir):
-            if filename.endswith(".json"):
-                keyboard_layout = json.load(open(f"{config_dir}/{filename}"))
-                layout_info.append(
-                    (
-                        keyboard_layout["type"],
-                        keyboard_layout["lang"],
-                        keyboard_layout["name"],
-                    )
-                )
-        return layout_info
+        index_path = self.create_path(self.LAYOUT_INDEX_PATH)
+        index = self.load_layout_index(index_path)
+
+        layouts = {}
+        changed = False
+        for entry in sorted(os.scandir(config_dir), key=lambda e: e.name):
+            if not entry.name.endswith(".json"):
+                continue
+            stat = entry.stat()
+            info = index.get(entry.name)
+            if (
+                not info
+                or info["mtime"] != stat.st_mtime
+                or info["size"] != stat.st_size
+            ):
+                self.log.debug(f"Indexing keyboard layout {entry.path}")
+                with open(entry.path) as f:
+                    keyboard_layout = json.load(f)
+                info = {
+                    "mtime": stat.st_mtime,
+                    "size": stat.st_size,
+                    "type": keyboard_layout["type"],
+                    "lang": keyboard_layout["lang"],
+                    "name": keyboard_layout["name"],
+                }
+                changed = True
+            layouts[entry.name] = info
 
-    def get_key_layout(self):
-        keyboard_layout_path = self.create_path(self.KEYBOARD_LAYOUT_FILE_PATH)
+        if changed or len(layouts) != len(index):
+            self.save_layout_index(index_path, layouts)
+        return [(info["type"], info["lang"], info["name"]) for info in layouts.values()]
+
+    def get_key_layout(self, c64_type=None, lang=None):
+        keyboard_layout_path = self.create_path(
+            self.KEYBOARD_LAYOUT_FILE_PATH, c64_type, lang
+        )
         self.log.debug(f"Loading keyboard layout {keyboard_layout_path}")
-        keyboard_layout = json.load(open(keyboard_layout_path))
+        with open(keyboard_layout_path) as f:
+            keyboard_layout = json.load(f)
         return keyboard_layout["keys"]
 
     def load_config(self, type="breadbin", lang=""):
@@ -61,25 +137,132 @@ class C64KeyboardLogic:
         self.lang = lang
 
         config_path = self.create_path(self.KEYBOARD_MATRIX_PATH)
+        key_config_path = self.create_path(self.KEY_CONFIG_PATH)
+        sources = (config_path, key_config_path)
+
+        config = self.compiled_configs.get(config_path)
+        if config is None:
+            config = self.load_compiled_config(sources)
+        if config is None:
+            config = self.compile_config(config_path, key_config_path)
+            self.save_compiled_config(sources, config)
+        self.compiled_configs[config_path] = config
+
+        self.layout = config["layout"]
+        self.key_matrix = config["matrix"]
+        self.no_shift = config["no-shift"]
+        self.special_release_keys = config["special-release-keys"]
+        self.special_keys = config["special-keys"]
+        self.key_mappings = config["key-mappings"]
+        self.key_table = config["key-table"]
+        self.text_table = config["text-table"]
+        self.token_table = config["token-table"]
+        self.log.debug(f"Loaded layout {self.c64_type} {self.layout}")
+
+    def compile_config(self, config_path, key_config_path):
         self.log.debug(f"Loading matrix {config_path}")
-        self.key_layout = json.load(open(config_path))
+        with open(config_path) as f:
+            self.key_layout = json.load(f)
         self.layout = self.key_layout["layout"]
-        self.log.debug(f"Loading layout {self.c64_type} {self.layout}")
         self.key_matrix = self.key_layout["matrix"]
         self.no_shift = self.key_layout["no-shift"]
+        self.special_release_keys = self.key_layout.get("special-release-keys", {})
 
-        self.special_release_keys = {}
-        if "special-release-keys" in self.key_layout:
-            self.special_release_keys = self.key_layout["special-release-keys"]
-
-        key_config_path = self.create_path(self.KEY_CONFIG_PATH)
         self.log.debug(f"Loading key config {key_config_path}")
-        key_config = json.load(open(key_config_path))
-
+        with open(key_config_path) as f:
+            key_config = json.load(f)
         self.special_keys = key_config["special-keys"]
         self.key_mappings = key_config["key-mappings"]
         self.key_mappings.update(self.key_layout["key-mappings"])
 
+        self.token_table = {}
+        self.compile_text_table()
+        self.compile_key_table()
+        return {
+            "layout": self.layout,
+            "matrix": self.key_matrix,
+            "no-shift": self.no_shift,
+            "special-release-keys": self.special_release_keys,
+            "special-keys": self.special_keys,
+            "key-mappings": self.key_mappings,
+            "key-table": self.key_table,
+            "text-table": self.text_table,
+            "token-table": self.token_table,
+        }
+
+    def compiled_config_path(self, config_path):
+        name = os.path.splitext(os.path.basename(config_path))[0]
+        return os.path.join(resources.cache_dir(), f"{name}.cache")
+
+    def source_stamps(self, sources):
+        stamps = []
+        for path in sources:
+            stat = os.stat(path)
+            stamps.append((os.path.abspath(path), stat.st_mtime_ns, stat.st_size))
+        return tuple(stamps)
+
+    def load_compiled_config(self, sources):
+        cache_path = self.compiled_config_path(sources[0])
+        try:
+            with open(cache_path, "rb") as f:
+                version, stamps, config = marshal.load(f)
+            if version != self.COMPILED_CONFIG_VERSION:
+                return None
+            if stamps != self.source_stamps(sources):
+                self.log.debug(f"Compiled config {cache_path} is stale")
+                return None
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+
+        self.log.debug(f"Loaded compiled config {cache_path}")
+        config["text-table"] = _TextTable(config["text-table"])
+        return config
+
+    def save_compiled_config(self, sources, config):
+        cache_path = self.compiled_config_path(sources[0])
+        blob = dict(config, **{"text-table": dict(config["text-table"])})
+        blob["token-table"] = {}
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = f"{cache_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                marshal.dump(
+                    (self.COMPILED_CONFIG_VERSION, self.source_stamps(sources), blob), f
+                )
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            self.log.debug(f"Cannot write compiled config {cache_path}: {e}")
+
+    def compile_text_table(self):
+        chars = {k for k in self.key_matrix if len(k) == 1}
+        chars.update(k for k in self.key_mappings if len(k) == 1)
+        chars.update(self.SHIFTED_CHARACTERS)
+
+        self.text_table = _TextTable()
+        for c in chars:
+            key_combo = self.build_key_combination(c)
+            if key_combo:
+                values = self.combination_to_matrix(key_combo, True)
+                if values:
+                    self.text_table[ord(c)] = values.decode("latin-1")
+        for c, token in self.TEXT_REPLACEMENTS.items():
+            self.text_table[ord(c)] = self.encode_token(token).decode("latin-1")
+        self.log.debug(f"Compiled {len(self.text_table)} text characters")
+
+    def compile_key_table(self):
+        keys = set(self.key_matrix)
+        keys.update(self.key_mappings)
+        keys.update(self.special_keys)
+        keys.update(self.special_release_keys)
+        keys.update(k.upper() for k in self.key_matrix if len(k) == 1)
+
+        self.key_table = {}
+        for key in keys:
+            for pressed in (True, False):
+                values = self._translate_key(key, pressed)
+                self.key_table[(key, pressed)] = bytes(values) if values else None
+        self.log.debug(f"Compiled {len(self.key_table)} key translations")
+
     def get_matrix_value(self, c):
         return self.key_matrix.get(c, -1)
 
@@ -124,14 +307,15 @@ class C64KeyboardLogic:
         elif key_combo == "LOAD_8":
             key_combo = self.LOAD_8
 
-        if not pressed:
+        if not pressed and key_combo:
             value = self.get_special_release_value(c)
             if value:
                 key_combo = key_combo + "|" + value
 
 
         if key_combo and key_combo != c and not '|' in key_combo:
-            self.log.debug(f"Key: {c} -> {key_combo}")
+            if trace.enabled:
+                trace.record(trace.KEY_COMBINATION, pressed, f"{c}>{key_combo}")
             tmp_combo = self.build_key_combination(key_combo, pressed)
             if tmp_combo:
                 return tmp_combo
@@ -142,24 +326,23 @@ class C64KeyboardLogic:
         values = self.combination_to_matrix(key_combo, pressed)
 
         if values:
-            self.log.debug(f"key combination: {key_combo}")
-            hex_string = " ".join(f"0x{element:02X}" for element in values)
-            self.log.debug(f"values: {hex_string}")
+            if trace.enabled:
+                trace.record(trace.KEY_COMBINATION, pressed, key_combo)
             return values
         else:
-            self.log.debug(f"Unknown key combination: {key_combo}")
-            self.log.debug("----------------------------------------")
+            if trace.enabled:
+                trace.record(trace.UNKNOWN_COMBINATION, pressed, key_combo)
             return b''
 
     def translate_key(self, c, pressed=True):
-        hex_string = ""
-        if re.match("[\\w!@#$%^&*()-_=+\\\\|,<.>/?`~\\[\\]{}\"\\']", c):
-            self.log.debug(f"'{c}' key: {hex_string}")
-        else:
-            for element in c:
-                hex_string += f"0x{ord(element):02X} "
-            self.log.debug(f"other key: {hex_string}")
+        if trace.enabled:
+            trace.record(trace.TRANSLATE, pressed, c)
+        values = self.key_table.get((c, pressed), _NOT_COMPILED)
+        if values is _NOT_COMPILED:
+            return self._translate_key(c, pressed)
+        return values
 
+    def _translate_key(self, c, pressed=True):
         key_combo = self.build_key_combination(c, pressed)
         if key_combo:
             return self.trasnslate_key_combination(key_combo, pressed)
@@ -169,18 +352,114 @@ class C64KeyboardLogic:
         if key_combo.startswith(self.LINE_PREFIX):
             if not pressed:
                 return
-            self.log.debug(f"Process command line: {key_combo}")
-            values = self.parse_key_combination("TEXT", True)
-            text = key_combo[len(self.LINE_PREFIX) :]
-            text = text.replace("\n", "{RETURN}").replace(" ", "{SPACE}").replace('|', '{UP_ARROW}').replace('_', '{LEFT_ARROW}')
-            self.log.debug(f"Text: {text}")
-            for m in re.finditer(r"(\{(\w+)\})|.", text):
-                key_combo = self.build_key_combination(m.group())
-                if key_combo:
-                    values.extend(self.parse_key_combination(key_combo))
-                # time.sleep(0.05)
-            values.extend(self.parse_key_combination("TEXT", False))
+            values = self.encode_text(key_combo[len(self.LINE_PREFIX) :])
+            if trace.enabled:
+                trace.record(trace.COMMAND_LINE, len(values), values)
             return values
         else:
-            self.log.debug(f"Process key combination: {key_combo}")
             return self.parse_key_combination(key_combo, pressed)
+
+    def encode_token(self, token):
+        values = self.token_table.get(token)
+        if values is None:
+            key_combo = self.build_key_combination(f"{{{token}}}")
+            values = b""
+            if key_combo:
+                values = bytes(self.combination_to_matrix(key_combo, True))
+            self.token_table[token] = values
+        return values
+
+    def encode_text(self, text):
+        values = self.combination_to_matrix("TEXT", True)
+        parts = self.TOKEN_PATTERN.split(text)
+        for i, part in enumerate(parts):
+            if i % 2:
+                values += self.encode_token(part)
+            elif part:
+                values += part.translate(self.text_table).encode("latin-1")
+        values += self.combination_to_matrix("TEXT", False)
+        return values
+
+    def iter_encode_text(self, text, size=100):
+        piece = ""
+        for i, part in enumerate(self.TOKEN_PATTERN.split(text)):
+            if i % 2:
+                part = f"{{{part}}}"
+                if piece and len(piece) + len(part) > size:
+                    yield len(piece), self.encode_text(piece)
+                    piece = ""
+                piece += part
+                continue
+            while part:
+                take = size - len(piece)
+                if take > 0:
+                    piece += part[:take]
+                    part = part[take:]
+                if len(piece) >= size:
+                    yield len(piece), self.encode_text(piece)
+                    piece = ""
+        if piece:
+            yield len(piece), self.encode_text(piece)
+
+    def key_event(self, c, pressed=True):
+        return self.update_matrix_state(self.translate_key(c, pressed))
+
+    def update_matrix_state(self, values):
+        if not values or values[0] == self.get_special_value("TEXT") | 0x80:
+            return values
+
+        reset = self.get_special_value("RESET_MATRIX")
+        held = {self.get_special_value(name) for name in self.STATE_SPECIAL_KEYS}
+        changes = bytearray()
+        for value in values:
+            key = value & 0x7F
+            if key == reset:
+                self.matrix_state = 0
+                self.special_state = 0
+                changes.append(value)
+                continue
+            if key >= self.MATRIX_SIZE and key not in held:
+                # One-shot commands such as resets carry no key state
+                changes.append(value)
+                continue
+
+            if key < self.MATRIX_SIZE:
+                bit = 1 << key
+                state = self.matrix_state
+            else:
+                bit = 1 << (key & 0x3F)
+                state = self.special_state
+            if bool(value & 0x80) == bool(state & bit):
+                continue
+            state ^= bit
+
+            if key < self.MATRIX_SIZE:
+                self.matrix_state = state
+            else:
+                self.special_state = state
+            changes.append(value)
+        return changes
+
+    def key_state(self):
+        return self.matrix_state | self.special_state << self.MATRIX_SIZE
+
+    def pressed_keys(self):
+        return [key for key in range(self.MATRIX_SIZE) if self.matrix_state >> key & 1]
+
+    def full_state(self):
+        values = bytearray([self.get_special_value("RESET_MATRIX") | 0x80])
+        values.extend(key | 0x80 for key in self.pressed_keys())
+        for name in self.STATE_SPECIAL_KEYS:
+            value = self.get_special_value(name)
+            if value >= 0 and self.special_state >> (value & 0x3F) & 1:
+                values.append(value | 0x80)
+        return values
+
+    def release_all(self):
+        values = bytearray(self.pressed_keys())
+        for index in range(self.MATRIX_SIZE):
+            if self.special_state >> index & 1:
+                values.append(index | 0x40)
+        self.matrix_state = 0
+        self.special_state = 0
+        return values
@@ -0,0 +1,83 @@
+import collections
+import json
+import os
+import threading
+import time
+
+
+STAGES = ("translate", "write", "echo", "total")
+SAMPLE_WINDOW = 4096  # most recent samples kept per stage
+DUMP_INTERVAL = 10  # seconds
+
+
+class LatencyHistogram:
+    def __init__(self, window=SAMPLE_WINDOW):
+        self.samples = collections.deque(maxlen=window)
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, samples, fraction):
+        if not samples:
+            return 0.0
+        return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+    def summary(self):
+        samples = sorted(self.samples)
+        return {
+            "count": self.count,
+            "p50": self.percentile(samples, 0.5) * 1000,
+            "p99": self.percentile(samples, 0.99) * 1000,
+            "max": self.max * 1000,
+        }
+
+
+class LatencyTracker:
+    def __init__(self, window=SAMPLE_WINDOW):
+        self.histograms = {stage: LatencyHistogram(window) for stage in STAGES}
+        self.dump_thread = None
+        self.dump_stop = threading.Event()
+
+    # Connections complete a sample when its frame is written and, with acks,
+    # when the device acknowledges it
+    def sample(self, start):
+        return start, time.perf_counter()
+
+    def record(self, sample, written, acked=None):
+        start, translated = sample
+        self.histograms["translate"].add(translated - start)
+        self.histograms["write"].add(written - translated)
+        if acked is not None:
+            self.histograms["echo"].add(acked - written)
+        self.histograms["total"].add((acked or written) - start)
+
+    def summary(self):
+        return {stage: h.summary() for stage, h in self.histograms.items()}
+
+    def dump(self, path):
+        data = {"time": time.time(), "stages": self.summary()}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def start_dump(self, path, interval=DUMP_INTERVAL):
+        def run():
+            while not self.dump_stop.wait(interval):
+                try:
+                    self.dump(path)
+                except OSError:
+                    pass
+
+        self.dump_stop.clear()
+        self.dump_thread = threading.Thread(target=run)
+        self.dump_thread.daemon = True
+        self.dump_thread.start()
+
+    def stop_dump(self):
+        self.dump_stop.set()
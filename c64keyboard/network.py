@@ -0,0 +1,91 @@
+import select
+import socket
+from urllib.parse import urlsplit
+from .transport import Connection
+
+
+DEFAULT_PORT = 6464
+CONNECT_TIMEOUT = 2  # seconds
+READ_TIMEOUT = 0.1  # seconds
+WRITE_TIMEOUT = 1  # seconds
+READ_SIZE = 4096
+MAX_DATAGRAM_SIZE = 1024  # bytes, stays well below common path MTUs
+
+
+def parse_address(path):
+    url = urlsplit(path)
+    if url.scheme not in ("tcp", "udp"):
+        raise ValueError(f"Unsupported network address {path}")
+    return url.scheme, url.hostname or "localhost", url.port or DEFAULT_PORT
+
+
+# Over UDP every writer batch is one datagram and lost ones are not resent
+class NetworkConnection(Connection):
+    LOGGER_NAME = "NetworkConnection"
+
+    def __init__(self, path=None, callback=None, line_callback=None):
+        self.sock = None
+        self.received = bytearray()
+        self.udp = False
+        super().__init__(path, callback, line_callback)
+
+    @property
+    def max_batch_size(self):
+        return MAX_DATAGRAM_SIZE if self.udp else None
+
+    def open_transport(self):
+        scheme, host, port = parse_address(self.connection_path)
+        self.udp = scheme == "udp"
+        kind = socket.SOCK_DGRAM if self.udp else socket.SOCK_STREAM
+        family, _, _, _, address = socket.getaddrinfo(host, port, type=kind)[0]
+        sock = socket.socket(family, kind)
+        try:
+            sock.settimeout(CONNECT_TIMEOUT)
+            sock.connect(address)
+            if not self.udp:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setblocking(False)
+        except OSError:
+            sock.close()
+            raise
+        self.received.clear()
+        self.sock = sock
+
+    def close_transport(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def write_bytes(self, data):
+        sock = self.sock
+        if self.udp:
+            sock.send(data)
+            return
+        view = memoryview(data)
+        while view:
+            try:
+                view = view[sock.send(view) :]
+            except BlockingIOError:
+                _, writable, _ = select.select([], [sock], [], WRITE_TIMEOUT)
+                if not writable:
+                    raise TimeoutError(f"Write to {self.connection_path} timed out")
+
+    def readline(self):
+        sock = self.sock
+        if sock is None:
+            raise ConnectionError(f"{self.connection_path} is closed")
+        while b"\n" not in self.received:
+            readable, _, _ = select.select([sock], [], [], READ_TIMEOUT)
+            if not readable:
+                return b""
+            try:
+                data = sock.recv(READ_SIZE)
+            except BlockingIOError:
+                continue
+            if not data and not self.udp:
+                raise ConnectionError(f"{self.connection_path} closed by peer")
+            self.received += data
+        end = self.received.index(b"\n") + 1
+        line = bytes(self.received[:end])
+        del self.received[:end]
+        return line
@@ -0,0 +1,94 @@
+import logging
+import queue
+import threading
+from . import protocol
+
+
+class PasteStream:
+    READY_SIGNAL = protocol.READY_REPLY
+    READY_TIMEOUT = 2  # seconds
+    QUEUE_SIZE = 4
+
+    def __init__(self, chunks, send, total=0, drain=None):
+        self.log = logging.getLogger("c64keyboard")
+        self.chunks = chunks
+        self.send = send
+        # Without ready signals from the device, pace on the writer queue
+        self.drain = drain
+        self.total = total
+        self.sent = 0
+
+        self.queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self.ready = threading.Event()
+        self.ready.set()
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+
+        self.encode_thread = threading.Thread(target=self.encode_chunks)
+        self.encode_thread.daemon = True
+        self.send_thread = threading.Thread(target=self.send_chunks)
+        self.send_thread.daemon = True
+
+    def start(self):
+        self.encode_thread.start()
+        self.send_thread.start()
+
+    def cancel(self):
+        self.log.debug("Paste cancelled")
+        self.cancelled.set()
+        self.ready.set()
+
+    def notify_ready(self):
+        self.ready.set()
+
+    def on_device_line(self, line):
+        if line == self.READY_SIGNAL:
+            self.notify_ready()
+
+    def is_running(self):
+        return not self.done.is_set()
+
+    def progress(self):
+        if not self.total:
+            return 1.0
+        return min(self.sent / self.total, 1.0)
+
+    def put(self, item):
+        while not self.cancelled.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def encode_chunks(self):
+        for chunk in self.chunks:
+            if not self.put(chunk):
+                break
+        self.put(None)
+
+    def send_chunks(self):
+        try:
+            while not self.cancelled.is_set():
+                try:
+                    chunk = self.queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if chunk is None:
+                    break
+
+                length, data = chunk
+                if self.drain:
+                    self.drain(self.READY_TIMEOUT)
+                elif not self.ready.wait(self.READY_TIMEOUT):
+                    self.log.debug("No ready signal from device, sending anyway")
+                if self.cancelled.is_set():
+                    break
+                self.ready.clear()
+                if data and not self.send(data):
+                    self.log.debug("Paste aborted, device not accepting data")
+                    break
+                self.sent += length
+        finally:
+            self.done.set()
@@ -0,0 +1,147 @@
+MAX_FRAME_SIZE = 255
+
+HELLO = b"cbm"
+HELLO_REPLY = "c64"
+CAPABILITIES_REQUEST = b"caps"
+CAPABILITIES_REPLY = "caps"
+CAPABILITY_REPEAT = "rle"
+CAPABILITY_BAUD = "baud"
+BAUD_REQUEST = b"baud"
+BAUD_REPLY = "baud"
+ECHO_REQUEST = b"echo"
+ECHO_REPLY = "echo"
+# An ack request carries a 16 bit sequence number; the device answers
+# "ack <sequence>" once it has applied the frames sent before it
+CAPABILITY_ACK = "ack"
+ACK_REQUEST = b"ack"
+ACK_REPLY = "ack"
+# The device sends "rdy" when it has typed a text frame and can take the next
+CAPABILITY_READY = "rdy"
+READY_REPLY = "rdy"
+
+# REPEAT, count, unit length, <unit bytes>: send the unit count times
+REPEAT = 0x7F
+MAX_REPEAT_COUNT = 255
+MAX_REPEAT_UNIT = 4
+REPEAT_HEADER_SIZE = 3
+
+
+def frame(data):
+    return bytes([len(data)]) + data
+
+
+def parse_capabilities(line):
+    parts = line.split()
+    if not parts or parts[0] != CAPABILITIES_REPLY:
+        return None
+    return set(parts[1:])
+
+
+def baud_request(rate):
+    return BAUD_REQUEST + rate.to_bytes(4, byteorder="big")
+
+
+def baud_reply(rate):
+    return f"{BAUD_REPLY} {rate}"
+
+
+def echo_reply(token):
+    return f"{ECHO_REPLY} {token.decode()}"
+
+
+def ack_request(sequence):
+    return ACK_REQUEST + sequence.to_bytes(2, byteorder="big")
+
+
+def ack_reply(sequence):
+    return f"{ACK_REPLY} {sequence}"
+
+
+def parse_ack(line):
+    parts = line.split()
+    if len(parts) != 2 or parts[0] != ACK_REPLY or not parts[1].isdigit():
+        return None
+    return int(parts[1])
+
+
+def repeat_count(view, start, unit):
+    end = len(view)
+    first = view[start : start + unit]
+    count = 1
+    pos = start + unit
+    while (
+        count < MAX_REPEAT_COUNT
+        and pos + unit <= end
+        and view[pos] == view[start]
+        and view[pos : pos + unit] == first
+    ):
+        count += 1
+        pos += unit
+    return count
+
+
+def encode_runs(data):
+    view = memoryview(data)
+    length = len(view)
+    literal = 0
+    pos = 0
+    while pos < length:
+        best_unit = 0
+        best_count = 0
+        best_saving = 0
+        for unit in range(1, MAX_REPEAT_UNIT + 1):
+            if pos + 2 * unit > length:
+                break
+            if view[pos + unit] != view[pos]:
+                continue
+            count = repeat_count(view, pos, unit)
+            saving = unit * count - (REPEAT_HEADER_SIZE + unit)
+            if saving > best_saving:
+                best_unit, best_count, best_saving = unit, count, saving
+
+        if best_saving > 0:
+            if literal < pos:
+                yield view[literal:pos]
+            yield bytes([REPEAT, best_count, best_unit]) + view[pos : pos + best_unit]
+            pos += best_unit * best_count
+            literal = pos
+        else:
+            pos += 1
+    if literal < length:
+        yield view[literal:length]
+
+
+def pack_frames(tokens, size=MAX_FRAME_SIZE):
+    payload = bytearray()
+    for token in tokens:
+        if isinstance(token, memoryview):
+            while token:
+                free = size - len(payload)
+                payload += token[:free]
+                token = token[free:]
+                if len(payload) == size:
+                    yield bytes(payload)
+                    payload = bytearray()
+        else:
+            if len(payload) + len(token) > size:
+                yield bytes(payload)
+                payload = bytearray()
+            payload += token
+    if payload:
+        yield bytes(payload)
+
+
+def decode_runs(data):
+    values = bytearray()
+    pos = 0
+    while pos < len(data):
+        if data[pos] == REPEAT:
+            count = data[pos + 1]
+            unit = data[pos + 2]
+            start = pos + REPEAT_HEADER_SIZE
+            values += data[start : start + unit] * count
+            pos = start + unit
+        else:
+            values.append(data[pos])
+            pos += 1
+    return values
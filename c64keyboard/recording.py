@@ -0,0 +1,88 @@
+import struct
+import time
+
+
+MAGIC = b"C64K"
+VERSION = 1
+
+KEY_PRESS = 1
+KEY_RELEASE = 2
+MATRIX = 3
+
+# delta since previous event in microseconds, kind, payload length
+RECORD = struct.Struct("<IBH")
+MAX_DELTA = 0xFFFFFFFF
+
+
+class RecordingError(Exception):
+    pass
+
+
+class EventRecorder:
+    def __init__(self, path, append=False):
+        self.path = path
+        self.file = open(path, "ab" if append else "wb")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC + bytes([VERSION]))
+        self.last = time.perf_counter()
+        self.count = 0
+
+    def write(self, kind, payload):
+        now = time.perf_counter()
+        delta = min(int((now - self.last) * 1_000_000), MAX_DELTA)
+        self.last = now
+        self.file.write(RECORD.pack(delta, kind, len(payload)))
+        self.file.write(payload)
+        self.count += 1
+
+    def record_key(self, keysym, pressed):
+        self.write(KEY_PRESS if pressed else KEY_RELEASE, keysym.encode("utf-8"))
+
+    def record_matrix(self, data):
+        self.write(MATRIX, bytes(data))
+
+    def close(self):
+        self.file.close()
+
+
+def iter_events(path):
+    with open(path, "rb") as f:
+        header = f.read(len(MAGIC) + 1)
+        if len(header) <= len(MAGIC) or header[: len(MAGIC)] != MAGIC:
+            raise RecordingError(f"{path} is not a key recording")
+        version = header[len(MAGIC)]
+        if version != VERSION:
+            raise RecordingError(f"Unsupported recording version {version}")
+
+        timestamp = 0.0
+        while True:
+            record = f.read(RECORD.size)
+            if len(record) < RECORD.size:
+                return
+            delta, kind, length = RECORD.unpack(record)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            timestamp += delta / 1_000_000
+            if kind == MATRIX:
+                yield timestamp, kind, payload
+            else:
+                yield timestamp, kind, payload.decode("utf-8")
+
+
+def replay(path, on_key, on_matrix, realtime=True, speed=1.0, cancelled=None):
+    start = time.perf_counter()
+    count = 0
+    for timestamp, kind, payload in iter_events(path):
+        if cancelled and cancelled.is_set():
+            break
+        if realtime:
+            delay = start + timestamp / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        if kind == MATRIX:
+            on_matrix(payload)
+        else:
+            on_key(payload, kind == KEY_PRESS)
+        count += 1
+    return count
@@ -0,0 +1,30 @@
+import importlib.resources
+import os
+
+
+CACHE_DIR_NAME = "c64keyboard"
+
+
+def data_dir():
+    # Config and images ship inside the package, also when installed
+    return os.fspath(importlib.resources.files(__package__))
+
+
+def data_path(*parts):
+    return os.path.join(data_dir(), *parts)
+
+
+def cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, CACHE_DIR_NAME)
+
+
+def runtime_path(name):
+    base = os.environ.get("XDG_RUNTIME_DIR")
+    if base:
+        return os.path.join(base, f"{CACHE_DIR_NAME}-{name}")
+    import tempfile
+
+    return os.path.join(tempfile.gettempdir(), f"{CACHE_DIR_NAME}-{os.getuid()}-{name}")
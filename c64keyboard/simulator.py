@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import logging
+import os
+import random
+import select
+import socket
+import threading
+import time
+import tty
+from . import protocol
+
+
+DEFAULT_BAUD = 19200
+BAUD_REVERT_DELAY = 1  # seconds without an echo before a new rate is dropped
+TEXT_PRESS = 0xC4
+RESET_MATRIX = 0x43
+
+
+class SimulatedDevice:
+    def __init__(
+        self,
+        link=None,
+        capabilities=(
+            protocol.CAPABILITY_REPEAT,
+            protocol.CAPABILITY_BAUD,
+            protocol.CAPABILITY_ACK,
+            protocol.CAPABILITY_READY,
+        ),
+        max_baud=115200,
+        reliable_baud=None,
+        emulate_baud=True,
+        buffer_size=None,
+        drop_rate=0.0,
+        seed=None,
+    ):
+        self.log = logging.getLogger("C64Simulator")
+        self.link = link
+        self.capabilities = set(capabilities)
+        self.max_baud = max_baud
+        self.reliable_baud = reliable_baud
+        self.emulate_baud = emulate_baud
+        self.buffer_size = buffer_size
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+
+        self.baud = DEFAULT_BAUD
+        self.previous_baud = DEFAULT_BAUD
+        self.revert_deadline = None
+        self.reverts = 0
+        self.matrix_state = 0
+        self.special_state = 0
+        self.typed = bytearray()
+        self.frames = []
+        self.dropped = 0
+        self.overflows = 0
+        self.bytes_lost = 0
+        self.handshakes = 0
+
+        self.master = None
+        self.slave = None
+        self.path = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+        if self.link:
+            if os.path.lexists(self.link):
+                os.remove(self.link)
+            os.symlink(self.path, self.link)
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        self.log.debug(f"Simulated device on {self.device_path()}")
+        return self.device_path()
+
+    def device_path(self):
+        return self.link or self.path
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        if self.link and os.path.lexists(self.link):
+            os.remove(self.link)
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+
+    def disappear(self):
+        self.log.debug("Simulating port disappearance")
+        self.stop()
+
+    def reappear(self):
+        self.baud = DEFAULT_BAUD
+        self.revert_deadline = None
+        return self.start()
+
+    def write(self, data):
+        os.write(self.master, data)
+
+    def reply(self, line):
+        self.write(line.encode() + b"\r\n")
+
+    def run(self):
+        buffer = bytearray()
+        while self.running:
+            readable, _, _ = select.select([self.master], [], [], 0.05)
+            self.check_baud_revert()
+            if not readable:
+                continue
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                break
+            self.feed(buffer, data)
+
+    def feed(self, buffer, data):
+        if self.emulate_baud:
+            # 10 bits per byte on an 8N1 line
+            time.sleep(len(data) * 10 / self.baud)
+        if self.buffer_size and len(data) > self.buffer_size:
+            # More than the device buffer arrived in one burst, the rest is lost
+            self.overflows += 1
+            self.bytes_lost += len(data) - self.buffer_size
+            data = data[: self.buffer_size]
+        buffer += data
+        while buffer and len(buffer) > buffer[0]:
+            length = buffer[0]
+            frame = bytes(buffer[1 : length + 1])
+            del buffer[: length + 1]
+            self.handle_frame(frame)
+
+    def handle_frame(self, frame):
+        self.frames.append((time.perf_counter(), len(frame)))
+        if frame == protocol.HELLO:
+            self.handshakes += 1
+            # The rate is kept, a reconnecting host handshakes at its cached
+            # rate. Only a power cycle (reappear) goes back to the default.
+            self.revert_deadline = None
+            self.reply(protocol.HELLO_REPLY)
+        elif frame == protocol.CAPABILITIES_REQUEST:
+            capabilities = " ".join(sorted(self.capabilities))
+            self.reply(f"{protocol.CAPABILITIES_REPLY} {capabilities}")
+        elif (
+            frame.startswith(protocol.BAUD_REQUEST)
+            and protocol.CAPABILITY_BAUD in self.capabilities
+        ):
+            rate = int.from_bytes(frame[len(protocol.BAUD_REQUEST) :], "big")
+            if rate <= self.max_baud:
+                self.reply(protocol.baud_reply(rate))
+                self.previous_baud = self.baud
+                self.baud = rate
+                self.revert_deadline = time.monotonic() + BAUD_REVERT_DELAY
+        elif (
+            frame.startswith(protocol.ECHO_REQUEST)
+            and protocol.CAPABILITY_BAUD in self.capabilities
+        ):
+            # Above the reliable rate the echo is garbled and never arrives
+            if not self.reliable_baud or self.baud <= self.reliable_baud:
+                self.reply(protocol.echo_reply(frame[len(protocol.ECHO_REQUEST) :]))
+                self.revert_deadline = None
+        elif (
+            frame.startswith(protocol.ACK_REQUEST)
+            and protocol.CAPABILITY_ACK in self.capabilities
+        ):
+            sequence = int.from_bytes(frame[len(protocol.ACK_REQUEST) :], "big")
+            self.reply(protocol.ack_reply(sequence))
+        elif self.drop_rate and self.random.random() < self.drop_rate:
+            self.dropped += 1
+        else:
+            if protocol.CAPABILITY_REPEAT in self.capabilities:
+                frame = protocol.decode_runs(frame)
+            self.apply_matrix(frame)
+            if (
+                frame
+                and frame[0] == TEXT_PRESS
+                and protocol.CAPABILITY_READY in self.capabilities
+            ):
+                self.reply(protocol.READY_REPLY)
+
+    def check_baud_revert(self):
+        if self.revert_deadline and time.monotonic() > self.revert_deadline:
+            self.log.debug(f"No echo at {self.baud} baud, back to {self.previous_baud}")
+            self.baud = self.previous_baud
+            self.revert_deadline = None
+            self.reverts += 1
+
+    def apply_matrix(self, values):
+        for value in values:
+            key = value & 0x7F
+            pressed = bool(value & 0x80)
+            if key == RESET_MATRIX:
+                self.matrix_state = 0
+                self.special_state = 0
+            elif key < 0x40:
+                if pressed:
+                    self.matrix_state |= 1 << key
+                    self.typed.append(key)
+                else:
+                    self.matrix_state &= ~(1 << key)
+            elif key < 0x80:
+                bit = 1 << (key & 0x3F)
+                if pressed:
+                    self.special_state |= bit
+                else:
+                    self.special_state &= ~bit
+
+    def stats(self):
+        elapsed = 0.0
+        if len(self.frames) > 1:
+            elapsed = self.frames[-1][0] - self.frames[0][0]
+        return {
+            "frames": len(self.frames),
+            "bytes": sum(length for _, length in self.frames),
+            "elapsed": elapsed,
+            "dropped": self.dropped,
+            "overflows": self.overflows,
+            "bytes_lost": self.bytes_lost,
+            "handshakes": self.handshakes,
+            "baud": self.baud,
+            "reverts": self.reverts,
+        }
+
+
+# Stands in for network attached hardware, one client at a time
+class LoopbackServer(SimulatedDevice):
+    def __init__(self, host="127.0.0.1", port=0, udp=False, **kwargs):
+        kwargs.setdefault("emulate_baud", False)
+        super().__init__(**kwargs)
+        self.host = host
+        self.port = port
+        self.udp = udp
+        self.server = None
+        self.client = None
+        self.peer = None
+
+    def start(self):
+        kind = socket.SOCK_DGRAM if self.udp else socket.SOCK_STREAM
+        self.server = socket.socket(socket.AF_INET, kind)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((self.host, self.port))
+        self.port = self.server.getsockname()[1]
+        if not self.udp:
+            self.server.listen(1)
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        self.log.debug(f"Simulated device on {self.device_path()}")
+        return self.device_path()
+
+    def device_path(self):
+        return f"{'udp' if self.udp else 'tcp'}://{self.host}:{self.port}"
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        for sock in (self.client, self.server):
+            if sock is not None:
+                sock.close()
+        self.client = self.server = None
+
+    def reappear(self):
+        return self.start()
+
+    def write(self, data):
+        if self.udp:
+            if self.peer:
+                self.server.sendto(data, self.peer)
+        elif self.client:
+            self.client.sendall(data)
+
+    def run(self):
+        buffer = bytearray()
+        while self.running:
+            sockets = [self.client or self.server]
+            readable, _, _ = select.select(sockets, [], [], 0.05)
+            self.check_baud_revert()
+            if not readable:
+                continue
+            if self.udp:
+                data, self.peer = self.server.recvfrom(65536)
+            elif self.client is None:
+                self.client, _ = self.server.accept()
+                buffer.clear()
+                continue
+            else:
+                try:
+                    data = self.client.recv(4096)
+                except OSError:
+                    data = b""
+                if not data:
+                    self.client.close()
+                    self.client = None
+                    continue
+            self.feed(buffer, data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated C64 keyboard device")
+    parser.add_argument("-l", "--link", help="symlink pointing at the pty")
+    parser.add_argument("--max-baud", type=int, default=115200)
+    parser.add_argument(
+        "--reliable-baud",
+        type=int,
+        help="fail the echo check above this rate, so the host has to fall back",
+    )
+    parser.add_argument("--no-baud-emulation", action="store_true")
+    parser.add_argument("--no-rle", action="store_true")
+    parser.add_argument(
+        "--no-rdy", action="store_true", help="do not send ready signals"
+    )
+    parser.add_argument(
+        "--buffer-size",
+        type=int,
+        help="drop bytes beyond this many per read, like a full device buffer",
+    )
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--flap",
+        type=float,
+        default=0,
+        help="make the port disappear and come back every N seconds",
+    )
+    parser.add_argument(
+        "--listen", type=int, metavar="PORT", help="listen on a local network port"
+    )
+    parser.add_argument("--udp", action="store_true", help="listen on UDP, not TCP")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG)
+    capabilities = {protocol.CAPABILITY_BAUD, protocol.CAPABILITY_ACK}
+    if not args.no_rle:
+        capabilities.add(protocol.CAPABILITY_REPEAT)
+    if not args.no_rdy:
+        capabilities.add(protocol.CAPABILITY_READY)
+    device_class = SimulatedDevice
+    if args.listen is not None:
+        device_class = LoopbackServer
+        options = {"port": args.listen, "udp": args.udp}
+    else:
+        options = {"link": args.link}
+    device = device_class(
+        capabilities=capabilities,
+        max_baud=args.max_baud,
+        reliable_baud=args.reliable_baud,
+        emulate_baud=not args.no_baud_emulation,
+        buffer_size=args.buffer_size,
+        drop_rate=args.drop_rate,
+        **options,
+    )
+    print(f"Simulated device on {device.start()}")
+    try:
+        while True:
+            time.sleep(args.flap or 5)
+            print(device.stats())
+            if args.flap:
+                device.disappear()
+                time.sleep(1)
+                device.reappear()
+    except KeyboardInterrupt:
+        device.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import itertools
+import struct
+import time
+
+
+# perf_counter timestamp, event, value, payload length, first payload bytes
+RECORD = struct.Struct("<dHIH16s")
+DEFAULT_CAPACITY = 65536  # records
+
+KEY_EVENT = 1
+TRANSLATE = 2
+KEY_COMBINATION = 3
+UNKNOWN_COMBINATION = 4
+COMMAND_LINE = 5
+SEND = 6
+WRITE = 7
+RECEIVE = 8
+ACK = 9
+
+EVENT_NAMES = {
+    KEY_EVENT: "key_event",
+    TRANSLATE: "translate",
+    KEY_COMBINATION: "key_combination",
+    UNKNOWN_COMBINATION: "unknown_combination",
+    COMMAND_LINE: "command_line",
+    SEND: "send",
+    WRITE: "write",
+    RECEIVE: "receive",
+    ACK: "ack",
+}
+# Payloads of these events are text, the others raw matrix bytes
+TEXT_EVENTS = {KEY_EVENT, TRANSLATE, KEY_COMBINATION, UNKNOWN_COMBINATION, RECEIVE}
+
+# Trace points check this flag before calling record(), so they cost a single
+# attribute lookup while tracing is off.
+enabled = False
+
+_buffer = bytearray()
+_capacity = 0
+_counter = itertools.count()
+
+
+def enable(capacity=DEFAULT_CAPACITY):
+    global enabled, _buffer, _capacity, _counter
+    _buffer = bytearray(capacity * RECORD.size)
+    _capacity = capacity
+    _counter = itertools.count()
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def record(event, value=0, payload=b""):
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8", errors="replace")
+    # next() on itertools.count is atomic, so threads never share a slot
+    index = next(_counter)
+    RECORD.pack_into(
+        _buffer,
+        index % _capacity * RECORD.size,
+        time.perf_counter(),
+        event,
+        value & 0xFFFFFFFF,
+        len(payload),
+        bytes(payload[:16]),
+    )
+
+
+def records():
+    if not _capacity:
+        return []
+    # Taking a slot keeps the snapshot consistent with concurrent writers;
+    # it is left empty
+    count = next(_counter)
+    RECORD.pack_into(_buffer, count % _capacity * RECORD.size, 0, 0, 0, 0, b"")
+    result = []
+    for index in range(max(count - _capacity + 1, 0), count):
+        entry = RECORD.unpack_from(_buffer, index % _capacity * RECORD.size)
+        if entry[1]:
+            result.append(entry)
+    return result
+
+
+def format_record(timestamp, event, value, length, payload):
+    name = EVENT_NAMES.get(event, str(event))
+    payload = payload[: min(length, len(payload))]
+    if event in TEXT_EVENTS:
+        data = payload.decode("utf-8", errors="replace")
+    else:
+        data = " ".join(f"0x{byte:02X}" for byte in payload)
+    if length > len(payload):
+        data += f" ... ({length} bytes)"
+    return f"{timestamp:.6f} {name} {value} {data}"
+
+
+def dump(path):
+    with open(path, "w", encoding="utf-8") as f:
+        for entry in records():
+            f.write(format_record(*entry) + "\n")
@@ -0,0 +1,466 @@
+import abc
+import collections
+import logging
+import queue
+import threading
+import time
+from . import protocol
+from . import trace
+
+
+RECONNECT_DELAY = 5  # seconds
+COALESCE_WINDOW_US = 500  # microseconds
+DRAIN_INTERVAL = 0.01  # seconds
+READER_IDLE_TIMEOUT = 1  # seconds
+CAPABILITIES_TIMEOUT = 0.5  # seconds
+HANDSHAKE_TIMEOUT = 3  # seconds
+HANDSHAKE_BACKOFF = 0.05  # seconds
+HANDSHAKE_MAX_BACKOFF = 0.5  # seconds
+
+CONNECTED = "connected"
+DISCONNECTED = "disconnected"
+
+ConnectionEvent = collections.namedtuple("ConnectionEvent", ["type", "path"])
+
+# Write queue sample of an ack request, timed when the device answers it
+AckRequest = collections.namedtuple("AckRequest", ["sequence"])
+
+
+def encode_frames(data, repeat_runs=False):
+    if repeat_runs:
+        return list(protocol.pack_frames(protocol.encode_runs(data)))
+    view = memoryview(data)
+    size = protocol.MAX_FRAME_SIZE
+    return [view[offset : offset + size] for offset in range(0, len(view), size)]
+
+
+class Connection(abc.ABC):
+    LOGGER_NAME = "Connection"
+    max_batch_size = None
+
+    def __init__(self, path=None, callback=None, line_callback=None):
+        self.log = logging.getLogger(self.LOGGER_NAME)
+        self.log.debug(f"Creating connection: {path}")
+
+        self.callback = callback
+        self.line_callback = line_callback
+        self.event_queue = queue.Queue()
+
+        self.running = True
+        self.connected = False
+        self.connect_lock = threading.Lock()
+        self.state_lock = threading.Lock()
+        # Held around reads and writes so the transport is never closed under
+        # the reader or writer thread
+        self.read_lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.connection_path = path
+        self.capabilities = set()
+        self.handshake_latency = None
+        self.coalesce_window = COALESCE_WINDOW_US / 1_000_000
+        self.write_queue = collections.deque()
+        self.write_event = threading.Event()
+        self.writing = False
+        self.write_latency = 0.0
+        self.max_write_latency = 0.0
+        self.frames_written = 0
+        self.tracker = None
+        self.ack_sequence = 0
+        self.unacked = {}
+        self.bytes_written = 0
+        self.frames_dropped = 0
+        self.connects = 0
+        self.disconnects = 0
+        self.writer_thread = threading.Thread(target=self.write_frames)
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+
+        self.input_queue = queue.Queue()
+        self.reader_event = threading.Event()
+        self.reader_thread = threading.Thread(target=self.read_input)
+        self.reader_thread.daemon = True
+        self.reader_thread.start()
+
+        self.monitor_thread = threading.Thread(target=self.monitor_connection)
+        self.monitor_thread.daemon = True
+        self.monitor_thread.start()
+
+    # Transport specific operations
+
+    @abc.abstractmethod
+    def open_transport(self):
+        pass
+
+    @abc.abstractmethod
+    def close_transport(self):
+        pass
+
+    @abc.abstractmethod
+    def write_bytes(self, data):
+        pass
+
+    @abc.abstractmethod
+    def readline(self):
+        pass
+
+    def device_present(self):
+        return True
+
+    def wait_for_change(self, timeout):
+        time.sleep(timeout)
+
+    def monitor_stopped(self):
+        pass
+
+    def open_and_handshake(self):
+        self.open_transport()
+        if self.handshake():
+            return True
+        self.close_transport()
+        return False
+
+    def after_handshake(self):
+        pass
+
+    # Shared protocol handling
+
+    def _connect(self, path=None):
+        if path:
+            self.connection_path = path
+        if not self.device_present():
+            self.log.debug(f"Device {self.connection_path} not found")
+            return None
+
+        self.unacked.clear()
+        try:
+            if not self.open_and_handshake():
+                return
+            self.negotiate_capabilities()
+            self.after_handshake()
+            self.connected = True
+            self.reader_event.set()
+        except OSError as e:
+            self.log.debug(f"Cannot open device {self.connection_path}")
+            raise e
+
+        if self.connected:
+            self.connects += 1
+            self.post_event(CONNECTED)
+
+    def write_frame(self, data):
+        self.write_bytes(protocol.frame(data))
+
+    def read_line(self, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            line = self.readline()
+            if line:
+                line = line.decode("utf-8", errors="replace").strip()
+                self.log.debug(f"Received: {line}")
+                return line
+        return None
+
+    def handshake(self, timeout=HANDSHAKE_TIMEOUT):
+        self.capabilities = set()
+        start = time.monotonic()
+        deadline = start + timeout
+        backoff = HANDSHAKE_BACKOFF
+        while time.monotonic() < deadline:
+            self.write_frame(protocol.HELLO)
+            retry = min(time.monotonic() + backoff, deadline)
+            while time.monotonic() < retry:
+                line = self.read_line(retry - time.monotonic())
+                if line == protocol.HELLO_REPLY:
+                    self.handshake_latency = time.monotonic() - start
+                    self.log.debug(
+                        f"Handshake with {self.connection_path} took "
+                        f"{self.handshake_latency * 1000:.1f} ms"
+                    )
+                    return True
+            backoff = min(backoff * 2, HANDSHAKE_MAX_BACKOFF)
+        self.log.debug(f"No handshake reply from {self.connection_path}")
+        return False
+
+    def negotiate_capabilities(self):
+        self.write_frame(protocol.CAPABILITIES_REQUEST)
+        deadline = time.monotonic() + CAPABILITIES_TIMEOUT
+        while time.monotonic() < deadline:
+            line = self.read_line(deadline - time.monotonic())
+            capabilities = protocol.parse_capabilities(line or "")
+            if capabilities is not None:
+                self.capabilities = capabilities
+                break
+        self.log.debug(f"Device capabilities: {sorted(self.capabilities) or 'none'}")
+
+    def mark_disconnected(self):
+        # Several threads may notice a lost device at once, only one closes it
+        with self.state_lock:
+            connected = self.connected
+            self.connected = False
+        return connected
+
+    def close_io(self):
+        with self.write_lock, self.read_lock:
+            self.close_transport()
+
+    def _disconnect(self):
+        if not self.mark_disconnected():
+            return
+        self.disconnects += 1
+        try:
+            self.close_io()
+        except OSError:
+            pass
+        self.post_event(DISCONNECTED)
+
+    def connect(self):
+        if not self.running or not (self.connected or self.connection_path):
+            return
+
+        self.log.debug(f"Attempting to reconnect to {self.connection_path}...")
+        # The monitor thread and the GUI may both try to connect
+        with self.connect_lock:
+            if self.connected:
+                return
+            try:
+                self._connect()
+                if self.connected and not self.running:
+                    # Shut down while the handshake was in progress
+                    self.close()
+                elif self.connected:
+                    self.log.info(f"Connected to {self.connection_path}")
+
+            except OSError:
+                self.log.debug(f"Connection failed.")
+
+    def set_path(self, path=None):
+        self.connection_path = path
+        if self.connected:
+            self._disconnect()
+        self.connect()
+
+    def send_data(self, data, sample=None):
+        if not (self.connected and data):
+            return 0
+        queued = time.perf_counter()
+        self.queue_frames(queued, encode_frames(data, self.repeat_runs()), sample)
+        return len(data)
+
+    def repeat_runs(self):
+        return protocol.CAPABILITY_REPEAT in self.capabilities
+
+    def supports_ready(self):
+        return protocol.CAPABILITY_READY in self.capabilities
+
+    def supports_acks(self):
+        return protocol.CAPABILITY_ACK in self.capabilities
+
+    def queue_frames(self, queued, frames, sample=None):
+        entries = [(queued, frame, None) for frame in frames]
+        if sample and entries:
+            if self.supports_acks():
+                # The device answers the request after applying the key event
+                self.ack_sequence = (self.ack_sequence + 1) & 0xFFFF
+                sequence = self.ack_sequence
+                # Registered before writing, the answer may beat the writer
+                self.unacked[sequence] = [sample, None]
+                request = protocol.ack_request(sequence)
+                entries.append((queued, request, AckRequest(sequence)))
+            else:
+                # The last frame completes the key event
+                entries[-1] = (queued, frames[-1], sample)
+        self.write_queue.extend(entries)
+        self.write_event.set()
+
+    def set_tracker(self, tracker):
+        self.tracker = tracker
+
+    def complete_samples(self, tracker, samples, written):
+        for sample in samples:
+            if isinstance(sample, AckRequest):
+                pending = self.unacked.get(sample.sequence)
+                if pending:
+                    pending[1] = written
+            elif sample:
+                tracker.record(sample, written)
+
+    def on_ack(self, sequence, acked):
+        if sequence not in self.unacked:
+            return
+        # Requests written before this one were lost, drop them in order
+        for pending in list(self.unacked):
+            sample, written = self.unacked.pop(pending)
+            if pending == sequence:
+                break
+        tracker = self.tracker
+        if tracker:
+            tracker.record(sample, written or acked, acked)
+
+    def queue_depth(self):
+        return len(self.write_queue)
+
+    def write_frames(self):
+        while self.running:
+            self.write_event.wait()
+            self.write_event.clear()
+            if self.coalesce_window:
+                time.sleep(self.coalesce_window)
+
+            limit = self.max_batch_size
+            self.writing = True
+            tracker = self.tracker
+            samples = []
+            batch = bytearray()
+            first_queued = None
+            frames = 0
+            while self.write_queue:
+                size = len(batch) + len(self.write_queue[0][1]) + 1
+                if limit and batch and size > limit:
+                    self.write_event.set()
+                    break
+                queued, data, sample = self.write_queue.popleft()
+                if first_queued is None:
+                    first_queued = queued
+                if tracker:
+                    samples.append(sample)
+                batch.append(len(data))
+                batch += data
+                frames += 1
+            if not batch:
+                self.writing = False
+                continue
+
+            written = None
+            try:
+                with self.write_lock:
+                    if self.connected:
+                        self.write_bytes(batch)
+                        written = time.perf_counter()
+            except Exception as e:
+                # Keep writing after a reconnect whatever the transport raised
+                if self.running and self.connected:
+                    self.log.debug(f"Write to {self.connection_path} failed: {e}")
+                    self._disconnect()
+            if written is not None:
+                if tracker:
+                    self.complete_samples(tracker, samples, written)
+                self.write_latency = written - first_queued
+                self.max_write_latency = max(self.max_write_latency, self.write_latency)
+                self.frames_written += frames
+                self.bytes_written += len(batch)
+                if trace.enabled:
+                    trace.record(trace.WRITE, frames, batch)
+            self.writing = False
+
+    def drain(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.write_queue or self.writing:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(DRAIN_INTERVAL)
+        return True
+
+    def read_lines(self):
+        lines = []
+        while True:
+            try:
+                lines.append(self.input_queue.get_nowait())
+            except queue.Empty:
+                return lines
+
+    def read_input(self):
+        while self.running:
+            if not self.connected:
+                self.reader_event.wait(READER_IDLE_TIMEOUT)
+                self.reader_event.clear()
+                continue
+            try:
+                with self.read_lock:
+                    if not self.connected:
+                        continue
+                    line = self.readline()
+            except Exception as e:
+                # Keep reading after a reconnect whatever the transport raised
+                if self.running and self.connected:
+                    self.log.debug(f"Read from {self.connection_path} failed: {e}")
+                    self._disconnect()
+                continue
+            line = line.decode("utf-8", errors="replace").strip()
+            if not line:
+                continue
+            sequence = protocol.parse_ack(line)
+            if sequence is not None:
+                self.on_ack(sequence, time.perf_counter())
+                if trace.enabled:
+                    trace.record(trace.ACK, sequence)
+                continue
+            if trace.enabled:
+                trace.record(trace.RECEIVE, 0, line)
+            if self.line_callback:
+                self.line_callback(line)
+            self.input_queue.put(line)
+
+    def close(self):
+        if self.mark_disconnected():
+            self.close_io()
+            self.post_event(DISCONNECTED)
+
+    def shutdown(self):
+        self.running = False
+        self.close()
+        self.write_event.set()
+        self.reader_event.set()
+
+    def is_connected(self):
+        return self.connected
+
+    def stats(self):
+        return {
+            "connected": self.connected,
+            "connects": self.connects,
+            "disconnects": self.disconnects,
+            "frames_written": self.frames_written,
+            "bytes_written": self.bytes_written,
+            "frames_dropped": self.frames_dropped,
+            "queue_depth": len(self.write_queue),
+            "write_latency": self.write_latency,
+            "max_write_latency": self.max_write_latency,
+        }
+
+    def post_event(self, event_type):
+        self.event_queue.put(ConnectionEvent(event_type, self.connection_path))
+
+    def dispatch_events(self):
+        while True:
+            try:
+                event = self.event_queue.get_nowait()
+            except queue.Empty:
+                return
+            if self.callback:
+                self.callback(event)
+
+    def monitor_connection(self):
+        while self.running:
+            if self.connected:
+                if not self.device_present():
+                    self.log.debug(f"Port {self.connection_path} disappeared")
+                    self._disconnect()
+            else:
+                self.connect()
+            self.wait_for_change(RECONNECT_DELAY)
+        self.monitor_stopped()
+
+
+def connection_class(path=None):
+    if path and "://" in path:
+        from .network import NetworkConnection
+
+        return NetworkConnection
+
+    from .connection import SerialConnection
+
+    return SerialConnection
+
+
+def open_connection(path=None, **kwargs):
+    return connection_class(path)(path, **kwargs)
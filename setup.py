@@ -5,24 +5,24 @@ setup(
     version="1.0",
     description="Emulator for C64 keyboard",
     author="Henrik",
-    packages=find_packages(),
+    packages=find_packages(exclude=["tests", "tests.*"]),
     install_requires=[
-        "tkinter",
-        "time",
-        "argparse",
         "pyserial",
-        "re",
-        "json",
-        "numpy",
+        "Pillow",
         # Add any other required packages here
     ],
     # package_data={b'multigtfs': ['test/fixtures/*.zip']},
     include_package_data=True,
     package_data={
-        "": ["config/*.json", "images/*.*"],
+        "c64keyboard": [
+            "config/*.json",
+            "config/keyboard_layout/*.json",
+            "images/*.png",
+            "images/keys/*.png",
+        ],
     },
     entry_points={
-        "console_scripts": ["c64keyboard_emulator = c64keyboard_emulator.main:main"]
+        "console_scripts": ["c64keyboard_emulator = c64keyboard.cli:main"]
     },
     classifiers=[
         "Development Status :: 5 - Production/Stable",
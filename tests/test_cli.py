@@ -0,0 +1,22 @@
+import pytest
+from c64keyboard import cli
+
+
+def test_headless_needs_a_device():
+    with pytest.raises(SystemExit):
+        cli.parse_args(["--headless"])
+    assert cli.parse_args(["--headless", "-d", "/dev/null"]).devices == ["/dev/null"]
+
+
+@pytest.mark.parametrize(
+    "argv", [[], ["-t", "c64c"], ["-t", "breadbin", "-l", "sv"], ["-l", "en"]]
+)
+def test_known_layouts(argv):
+    cli.parse_args(argv)
+
+
+@pytest.mark.parametrize("argv", [["-t", "c64c", "-l", "sv"], ["-t", "vic20"]])
+def test_unknown_layouts_are_rejected(argv, capsys):
+    with pytest.raises(SystemExit):
+        cli.parse_args(argv)
+    assert "layout" in capsys.readouterr().err
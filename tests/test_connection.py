@@ -0,0 +1,145 @@
+import threading
+import time
+import pytest
+from c64keyboard import protocol
+from c64keyboard import transport
+from c64keyboard.fanout import ConnectionGroup
+from c64keyboard.latency import LatencyTracker
+from c64keyboard.simulator import LoopbackServer
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def device():
+    device = LoopbackServer()
+    device.start()
+    yield device
+    device.stop()
+
+
+@pytest.fixture
+def connection(device):
+    connection = transport.open_connection(device.device_path())
+    assert wait_for(connection.is_connected)
+    yield connection
+    connection.shutdown()
+
+
+def test_reader_survives_disconnects(connection):
+    for _ in range(5):
+        connection._disconnect()
+        assert wait_for(lambda: connection.connect() or connection.is_connected())
+    connection.send_data(bytes([0xC4, 0x81]))
+    assert wait_for(lambda: "rdy" in connection.input_queue.queue)
+    assert connection.reader_thread.is_alive()
+    assert connection.disconnects == 5
+
+
+def test_reader_survives_unexpected_errors(device):
+    from c64keyboard.network import NetworkConnection
+
+    class FlakyConnection(NetworkConnection):
+        failures = 1
+
+        def readline(self):
+            if self.failures and threading.current_thread() is self.reader_thread:
+                self.failures -= 1
+                # What pyserial raises when the port is closed mid read
+                raise TypeError("'NoneType' object cannot be interpreted as an integer")
+            return super().readline()
+
+    connection = FlakyConnection(device.device_path())
+    try:
+        assert wait_for(lambda: connection.disconnects == 1)
+        assert wait_for(lambda: connection.connect() or connection.is_connected())
+        connection.send_data(bytes([0xC4, 0x81]))
+        assert wait_for(lambda: "rdy" in connection.input_queue.queue)
+    finally:
+        connection.shutdown()
+
+
+def test_writer_survives_unexpected_errors(device):
+    from c64keyboard.network import NetworkConnection
+
+    class FlakyConnection(NetworkConnection):
+        failures = 1
+
+        def write_bytes(self, data):
+            if self.failures and threading.current_thread() is self.writer_thread:
+                self.failures -= 1
+                # What a socket closed by another thread looks like
+                raise AttributeError("'NoneType' object has no attribute 'send'")
+            super().write_bytes(data)
+
+    connection = FlakyConnection(device.device_path())
+    try:
+        assert wait_for(connection.is_connected)
+        connection.send_data(bytes([0x81]))
+        assert wait_for(lambda: connection.disconnects == 1)
+        assert wait_for(lambda: connection.connect() or connection.is_connected())
+        connection.send_data(bytes([0xC4, 0x81]))
+        assert wait_for(lambda: "rdy" in connection.input_queue.queue)
+        assert connection.writer_thread.is_alive()
+    finally:
+        connection.shutdown()
+
+
+class LossyAckServer(LoopbackServer):
+    acks = 0
+
+    def reply(self, line):
+        if line.startswith(protocol.ACK_REPLY):
+            self.acks += 1
+            if self.acks % 3 == 0:
+                return
+        super().reply(line)
+
+
+def send_events(target, tracker, count):
+    for i in range(count):
+        target.send_data(bytes([0x81 if i % 2 else 0x01]), sample=tracker.sample(0))
+    target.drain(5)
+
+
+def test_lost_acks_do_not_shift_later_samples():
+    device = LossyAckServer()
+    device.start()
+    connection = transport.open_connection(device.device_path())
+    tracker = LatencyTracker()
+    connection.set_tracker(tracker)
+    try:
+        assert wait_for(connection.is_connected)
+        send_events(connection, tracker, 31)
+        assert wait_for(lambda: not connection.unacked)
+        # Events whose ack was lost are not timed at all
+        assert tracker.summary()["echo"]["count"] == 31 - 31 // 3
+    finally:
+        connection.shutdown()
+        device.stop()
+
+
+def test_group_times_each_event_once():
+    devices = [LoopbackServer() for _ in range(3)]
+    group = ConnectionGroup()
+    tracker = LatencyTracker()
+    try:
+        for device in devices:
+            group.add(device.start())
+        group.set_tracker(tracker)
+        assert wait_for(lambda: len(group.connected_paths()) == 3)
+        send_events(group, tracker, 20)
+        assert wait_for(lambda: tracker.summary()["echo"]["count"] == 20)
+        time.sleep(0.1)
+        assert tracker.summary()["total"]["count"] == 20
+    finally:
+        group.shutdown()
+        for device in devices:
+            device.stop()
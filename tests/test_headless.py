@@ -0,0 +1,32 @@
+import io
+import pytest
+from c64keyboard import headless
+
+
+def chunks(text, size):
+    return list(headless.iter_text(io.StringIO(text), size))
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 8, 4096])
+def test_tokens_are_never_split(size):
+    text = "10 print {CLR}{HOME}hello{RETURN}"
+    result = chunks(text, size)
+    assert "".join(result) == text
+    for chunk in result:
+        start = chunk.rfind("{")
+        assert start < 0 or "}" in chunk[start:]
+
+
+def test_unterminated_token_is_flushed_at_the_end():
+    assert "".join(chunks("abc{RET", 2)) == "abc{RET"
+
+
+def test_long_brace_text_is_not_held_back():
+    text = "{" + "x" * (headless.MAX_TOKEN_LENGTH + 10)
+    result = chunks(text, 8)
+    assert "".join(result) == text
+    assert len(result) > 1
+
+
+def test_empty_stream():
+    assert chunks("", 8) == []
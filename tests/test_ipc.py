@@ -0,0 +1,131 @@
+import json
+import pytest
+from c64keyboard import ipc
+from c64keyboard import protocol
+
+
+def parse(data):
+    client = ipc.IpcClient(None)
+    client.received += data
+    return client.parse()
+
+
+def test_binary_commands():
+    data = (
+        ipc.encode_command(ipc.KEY_PRESS, "a")
+        + ipc.encode_command(ipc.MATRIX, b"\x81\x01")
+        + ipc.encode_command(ipc.TEXT, "hej")
+    )
+    commands, replies = parse(data)
+    assert commands == [
+        (ipc.KEY_PRESS, "a"),
+        (ipc.MATRIX, b"\x81\x01"),
+        (ipc.TEXT, "hej"),
+    ]
+    assert replies == []
+
+
+def test_partial_binary_command_waits_for_the_rest():
+    data = ipc.encode_command(ipc.TEXT, "hello")
+    client = ipc.IpcClient(None)
+    client.received += data[:4]
+    assert client.parse() == ([], [])
+    client.received += data[4:]
+    assert client.parse() == ([(ipc.TEXT, "hello")], [])
+
+
+def test_json_commands():
+    message = [
+        {"key": "a"},
+        {"key": "Shift_L", "pressed": True},
+        {"token": "{RETURN}"},
+        {"text": "list"},
+        {"matrix": [129, 1]},
+    ]
+    commands, replies = parse(json.dumps(message).encode() + b"\n")
+    assert commands == [
+        (ipc.KEY_PRESS, "a"),
+        (ipc.KEY_RELEASE, "a"),
+        (ipc.KEY_PRESS, "Shift_L"),
+        (ipc.TOKEN, "RETURN"),
+        (ipc.TEXT, "list"),
+        (ipc.MATRIX, b"\x81\x01"),
+    ]
+    assert replies == [{"ok": True}]
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        {"key": 5},
+        {"text": 7},
+        {"key": "a", "pressed": "yes"},
+        {"matrix": [256]},
+        {"matrix": [protocol.REPEAT]},
+        {"matrix": "abc"},
+        {"unknown": 1},
+        [1, 2],
+    ],
+)
+def test_invalid_json_commands_are_answered_with_errors(message):
+    data = json.dumps(message).encode() + b"\n" + b'{"key": "a"}\n'
+    commands, replies = parse(data)
+    assert "error" in replies[0]
+    assert commands == [(ipc.KEY_PRESS, "a"), (ipc.KEY_RELEASE, "a")]
+    assert replies[1] == {"ok": True}
+
+
+def test_malformed_json_is_answered_with_an_error():
+    commands, replies = parse(b"{not json\n")
+    assert commands == []
+    assert "error" in replies[0]
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"\x09",
+        ipc.encode_command(ipc.TEXT, b"\xff\xfe"),
+        ipc.encode_command(ipc.MATRIX, bytes([protocol.REPEAT, 2, 1, 0x81])),
+    ],
+)
+def test_invalid_binary_commands_raise(data):
+    with pytest.raises(ipc.IpcError):
+        parse(data)
+
+
+class RunningPaste:
+    running = True
+
+    def is_running(self):
+        return self.running
+
+
+def test_commands_after_text_wait_until_it_is_typed():
+    pytest.importorskip("tkinter")
+    from c64keyboard.keyboard import C64KeyboardEmulator
+
+    emulator = C64KeyboardEmulator()
+    sent = []
+
+    def type_text(text):
+        sent.append(text)
+        emulator.paste_stream = RunningPaste()
+
+    emulator.type_text = type_text
+    emulator.send_key = lambda key, pressed: sent.append((key, pressed))
+    emulator.ipc_queue.put(
+        [
+            (ipc.TEXT, "load"),
+            (ipc.TOKEN, "RETURN"),
+            (ipc.KEY_PRESS, "Return"),
+            (ipc.KEY_RELEASE, "Return"),
+            (ipc.TEXT, "run"),
+        ]
+    )
+    emulator.process_ipc()
+    assert sent == ["load{RETURN}"]
+
+    emulator.paste_stream.running = False
+    emulator.process_ipc()
+    assert sent == ["load{RETURN}", ("Return", True), ("Return", False), "run"]
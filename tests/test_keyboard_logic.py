@@ -0,0 +1,110 @@
+import pytest
+from c64keyboard.keyboard_logic import C64KeyboardLogic
+
+LAYOUTS = [("breadbin", ""), ("breadbin", "sv"), ("c64c", "")]
+
+
+@pytest.fixture(params=LAYOUTS, ids=lambda layout: "-".join(filter(None, layout)))
+def logic(request, tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    C64KeyboardLogic().load_config(*request.param)
+    # The second load must read the compiled tables back from the cache
+    logic = C64KeyboardLogic()
+    monkeypatch.setattr(logic, "compile_config", None)
+    logic.load_config(*request.param)
+    monkeypatch.undo()
+    return logic
+
+
+def test_key_table_matches_dynamic_translation(logic):
+    assert logic.key_table
+    for (key, pressed), values in logic.key_table.items():
+        expected = logic._translate_key(key, pressed)
+        assert values == (bytes(expected) if expected else None), (key, pressed)
+
+
+def test_unknown_keys_are_translated_dynamically(logic):
+    assert logic.translate_key("NoSuchKey") is None
+
+
+def encode_char(logic, c):
+    if c in logic.TEXT_REPLACEMENTS:
+        return logic.encode_token(logic.TEXT_REPLACEMENTS[c])
+    key_combo = logic.build_key_combination(c)
+    return bytes(logic.combination_to_matrix(key_combo, True)) if key_combo else b""
+
+
+def test_text_table_matches_dynamic_translation(logic):
+    assert logic.text_table
+    for code, values in logic.text_table.items():
+        assert values.encode("latin-1") == encode_char(logic, chr(code)), chr(code)
+
+
+def test_encode_text(logic):
+    text = 'Hello, World{RETURN}10 print "x"'
+    expected = bytearray(logic.combination_to_matrix("TEXT", True))
+    for part in ["Hello, World", "{RETURN}", '10 print "x"']:
+        if part.startswith("{"):
+            expected += logic.encode_token(part[1:-1])
+        else:
+            for c in part:
+                expected += encode_char(logic, c)
+    expected += logic.combination_to_matrix("TEXT", False)
+    assert logic.encode_text(text) == expected
+
+
+def test_characters_without_a_key_are_skipped(logic):
+    assert logic.encode_text("a☺b") == logic.encode_text("ab")
+
+
+def test_chunks_cover_the_text(logic):
+    text = "{HOME}" + "abc " * 100 + "{RETURN}"
+    chunks = list(logic.iter_encode_text(text, size=30))
+    assert sum(length for length, _ in chunks) == len(text)
+    text_press = logic.get_special_value("TEXT") | 0x80
+    assert all(values[0] == text_press for _, values in chunks)
+
+
+def test_only_changes_are_sent(logic):
+    a = logic.get_matrix_value("a")
+    b = logic.get_matrix_value("b")
+    assert logic.update_matrix_state(bytes([a | 0x80])) == bytes([a | 0x80])
+    assert logic.update_matrix_state(bytes([a | 0x80])) == b""
+    assert logic.update_matrix_state(bytes([a | 0x80, b | 0x80])) == bytes([b | 0x80])
+    assert logic.pressed_keys() == sorted([a, b])
+    assert logic.update_matrix_state(bytes([a])) == bytes([a])
+    assert logic.update_matrix_state(bytes([a])) == b""
+    assert logic.pressed_keys() == [b]
+
+
+def test_held_special_keys_are_tracked(logic):
+    restore = logic.get_special_value("RESTORE")
+    assert logic.update_matrix_state(bytes([restore | 0x80])) == bytes([restore | 0x80])
+    assert logic.update_matrix_state(bytes([restore | 0x80])) == b""
+    assert logic.update_matrix_state(bytes([restore])) == bytes([restore])
+
+
+def test_one_shot_special_keys_always_pass(logic):
+    reset = bytes([logic.get_special_value("WARM_RESET") | 0x80])
+    assert logic.update_matrix_state(reset) == reset
+    assert logic.update_matrix_state(reset) == reset
+    assert logic.special_state == 0
+
+
+def test_text_frames_pass_untouched(logic):
+    values = logic.encode_text("aa")
+    assert logic.update_matrix_state(values) == values
+    assert logic.matrix_state == 0
+
+
+def test_full_state_resets_and_presses_held_keys(logic):
+    a = logic.get_matrix_value("a")
+    shift_lock = logic.get_special_value("SHIFT_LOCK")
+    logic.update_matrix_state(bytes([a | 0x80, shift_lock | 0x80]))
+    reset = logic.get_special_value("RESET_MATRIX") | 0x80
+    assert logic.full_state() == bytes([reset, a | 0x80, shift_lock | 0x80])
+
+    assert sorted(logic.release_all()) == sorted([a, shift_lock])
+    assert logic.full_state() == bytes([reset])
+    values = bytes([reset, a | 0x80])
+    assert logic.update_matrix_state(values) == values
@@ -0,0 +1,61 @@
+import pytest
+from c64keyboard import protocol
+
+
+def encode(data):
+    return list(protocol.pack_frames(protocol.encode_runs(data)))
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"",
+        bytes([0x81]),
+        bytes([0x81, 0x01] * 300),
+        bytes([0x81, 0x82, 0x01, 0x02] * 100),
+        bytes(range(64)) * 10,
+        bytes([0x81] * 1000) + bytes(range(64)),
+    ],
+)
+def test_runs_round_trip(data):
+    frames = encode(data)
+    assert b"".join(protocol.decode_runs(frame) for frame in frames) == data
+
+
+def test_runs_compress_repeated_keys():
+    data = bytes([0x81, 0x01] * 100)
+    frames = encode(data)
+    assert sum(len(frame) for frame in frames) < len(data) // 10
+
+
+def test_frames_stay_within_size_limit():
+    data = bytes(range(64)) * 20
+    frames = encode(data)
+    assert len(frames) > 1
+    assert all(len(frame) <= protocol.MAX_FRAME_SIZE for frame in frames)
+
+
+def test_repeat_tokens_are_not_split_across_frames():
+    data = bytes(range(64)) * 3 + bytes([0x81] * 100)
+    for size in range(protocol.REPEAT_HEADER_SIZE + 1, 20):
+        frames = protocol.pack_frames(protocol.encode_runs(data), size)
+        assert b"".join(protocol.decode_runs(frame) for frame in frames) == data
+
+
+def test_frame_prefixes_length():
+    assert protocol.frame(b"cbm") == b"\x03cbm"
+
+
+def test_parse_capabilities():
+    assert protocol.parse_capabilities("caps rle baud") == {"rle", "baud"}
+    assert protocol.parse_capabilities("caps") == set()
+    assert protocol.parse_capabilities("c64") is None
+    assert protocol.parse_capabilities("") is None
+
+
+def test_parse_ack():
+    assert protocol.parse_ack(protocol.ack_reply(513)) == 513
+    assert protocol.ack_request(513) == b"ack\x02\x01"
+    assert protocol.parse_ack("ack") is None
+    assert protocol.parse_ack("ack x") is None
+    assert protocol.parse_ack("rdy") is None
@@ -0,0 +1,83 @@
+import pytest
+from c64keyboard import recording
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "keys.c64k"
+    recorder = recording.EventRecorder(path)
+    recorder.record_key("a", True)
+    recorder.record_key("a", False)
+    recorder.record_matrix(bytearray([0x81, 0x01]))
+    recorder.record_key("Å", True)
+    recorder.close()
+
+    events = list(recording.iter_events(path))
+    assert [(kind, payload) for _, kind, payload in events] == [
+        (recording.KEY_PRESS, "a"),
+        (recording.KEY_RELEASE, "a"),
+        (recording.MATRIX, b"\x81\x01"),
+        (recording.KEY_PRESS, "Å"),
+    ]
+    timestamps = [timestamp for timestamp, _, _ in events]
+    assert timestamps == sorted(timestamps)
+
+
+def test_recording_replaces_existing_file(tmp_path):
+    path = tmp_path / "keys.c64k"
+    for key in ("a", "b"):
+        recorder = recording.EventRecorder(path)
+        recorder.record_key(key, True)
+        recorder.close()
+    assert [payload for _, _, payload in recording.iter_events(path)] == ["b"]
+
+
+def test_appending_keeps_one_header(tmp_path):
+    path = tmp_path / "keys.c64k"
+    for key in ("a", "b"):
+        recorder = recording.EventRecorder(path, append=True)
+        recorder.record_key(key, True)
+        recorder.close()
+    assert [payload for _, _, payload in recording.iter_events(path)] == ["a", "b"]
+
+
+def test_emulator_records_keys_and_matrix_data(tmp_path):
+    pytest.importorskip("tkinter")
+    from c64keyboard.keyboard import C64KeyboardEmulator
+
+    path = tmp_path / "keys.c64k"
+    emulator = C64KeyboardEmulator()
+    emulator.recorder = recording.EventRecorder(path)
+    emulator.send_key("a", True)
+    emulator.send_matrix(b"\x81")
+    emulator.send_key("a", False)
+    emulator.stop_recording()
+
+    assert [(kind, payload) for _, kind, payload in recording.iter_events(path)] == [
+        (recording.KEY_PRESS, "a"),
+        (recording.MATRIX, b"\x81"),
+        (recording.KEY_RELEASE, "a"),
+    ]
+
+
+def test_truncated_record_ends_iteration(tmp_path):
+    path = tmp_path / "keys.c64k"
+    recorder = recording.EventRecorder(path)
+    recorder.record_key("a", True)
+    recorder.record_key("b", True)
+    recorder.close()
+    path.write_bytes(path.read_bytes()[:-1])
+    assert [payload for _, _, payload in recording.iter_events(path)] == ["a"]
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "keys.txt"
+    path.write_bytes(b"hello")
+    with pytest.raises(recording.RecordingError):
+        list(recording.iter_events(path))
+
+
+def test_rejects_unknown_version(tmp_path):
+    path = tmp_path / "keys.c64k"
+    path.write_bytes(recording.MAGIC + bytes([recording.VERSION + 1]))
+    with pytest.raises(recording.RecordingError):
+        list(recording.iter_events(path))
@@ -0,0 +1,122 @@
+import time
+import pytest
+from c64keyboard import protocol
+from c64keyboard import transport
+from c64keyboard.keyboard_logic import C64KeyboardLogic
+from c64keyboard.simulator import LoopbackServer, SimulatedDevice
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def device():
+    device = LoopbackServer()
+    device.start()
+    yield device
+    device.stop()
+
+
+def test_handshake_and_capabilities(device):
+    connection = transport.open_connection(device.device_path())
+    try:
+        assert wait_for(connection.is_connected)
+        assert connection.capabilities == device.capabilities
+        assert device.handshakes == 1
+    finally:
+        connection.shutdown()
+
+
+def test_typed_text_reaches_the_device(device):
+    logic = C64KeyboardLogic()
+    logic.load_config()
+    connection = transport.open_connection(device.device_path())
+    try:
+        assert wait_for(connection.is_connected)
+        values = logic.encode_text("hello")
+        connection.send_data(values)
+        assert wait_for(lambda: "rdy" in connection.input_queue.queue)
+        expected = [value & 0x7F for value in values if 0x80 <= value < 0xC0]
+        assert list(device.typed) == expected
+    finally:
+        connection.shutdown()
+
+
+def test_reconnects_after_the_device_comes_back(device):
+    connection = transport.open_connection(device.device_path())
+    try:
+        assert wait_for(connection.is_connected)
+        device.stop()
+        connection.send_data(bytes([0x81]))
+        assert wait_for(lambda: not connection.is_connected())
+        device.reappear()
+        assert wait_for(lambda: connection.connect() or connection.is_connected())
+        assert device.handshakes == 2
+        connection.send_data(bytes([0x81]))
+        assert wait_for(lambda: 1 in device.typed)
+    finally:
+        connection.shutdown()
+
+
+def test_repeat_runs_are_expanded(device):
+    connection = transport.open_connection(device.device_path())
+    try:
+        assert wait_for(connection.is_connected)
+        assert connection.repeat_runs()
+        connection.send_data(bytes([0x81, 0x01] * 50))
+        assert wait_for(lambda: len(device.typed) == 50)
+        assert device.stats()["bytes"] < 100
+    finally:
+        connection.shutdown()
+
+
+def test_overflowing_bytes_are_lost():
+    device = SimulatedDevice(capabilities=(), emulate_baud=False, buffer_size=4)
+    buffer = bytearray()
+    device.feed(buffer, protocol.frame(bytes([0x81, 0x82, 0x83])) + b"\x02\x84\x85")
+    assert list(device.typed) == [1, 2, 3]
+    assert device.stats()["bytes_lost"] == 3
+
+
+def test_baud_rate_falls_back_when_the_echo_fails():
+    pytest.importorskip("serial")
+    from c64keyboard import connection as serial_connection
+
+    device = SimulatedDevice(emulate_baud=False, max_baud=250000, reliable_baud=57600)
+    path = device.start()
+    serial_connection.BAUD_CACHE.pop(path, None)
+    connection = serial_connection.SerialConnection(path)
+    try:
+        assert wait_for(connection.is_connected)
+        assert connection.serial_connection.baudrate == 57600
+        assert device.baud == 57600
+        assert device.stats()["reverts"] == 1
+    finally:
+        connection.shutdown()
+        device.stop()
+
+
+def test_reconnect_keeps_the_negotiated_rate():
+    pytest.importorskip("serial")
+    from c64keyboard import connection as serial_connection
+
+    device = SimulatedDevice(emulate_baud=False)
+    path = device.start()
+    serial_connection.BAUD_CACHE.pop(path, None)
+    connection = serial_connection.SerialConnection(path)
+    try:
+        assert wait_for(connection.is_connected)
+        assert device.baud == 115200
+        connection.set_path(path)
+        assert connection.is_connected()
+        assert connection.serial_connection.baudrate == device.baud == 115200
+        assert device.handshakes == 2
+    finally:
+        connection.shutdown()
+        device.stop()
@@ -10,6 +10,10 @@ import os
 import unicodedata
 
 
+CONFIG_DIR = "c64keyboard/config"
+KEY_IMAGE_DIR = "c64keyboard/images/keys"
+
+
 def find_squares(img):
     squares = []
     img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
@@ -32,7 +36,7 @@ def get_square_position(square):
 
 def save_square(img, x, y, w, h, c64_type, key_text, layout, layout_sufix):
     key_name = f"{c64_type}_key_{key_text}"
-    filename = f"images/keys/{key_name}.png"
+    filename = f"{KEY_IMAGE_DIR}/{key_name}.png"
     square_img = img[y : y + h, x : x + w]
     if os.path.exists(filename):
         excisting = cv2.imread(filename)
@@ -42,7 +46,7 @@ def save_square(img, x, y, w, h, c64_type, key_text, layout, layout_sufix):
         ):
             return f"{key_name}.png", False
     key_name = f"{key_name}{layout_sufix}"
-    filename = f"images/keys/{key_name}.png"
+    filename = f"{KEY_IMAGE_DIR}/{key_name}.png"
     print(f"Saving {filename}")
     cv2.imwrite(f"{filename}", square_img)
     return f"{key_name}.png", True
@@ -74,7 +78,7 @@ def find_point_in_rectangle(rect, points):
 
 
 def load_config(layout):
-    keyboard_matrix = json.load(open(f"config/keyboard_matrix{layout}.json"))
+    keyboard_matrix = json.load(open(f"{CONFIG_DIR}/keyboard_matrix{layout}.json"))
     print(f"Loading config for {keyboard_matrix['layout']} layout.")
     key_matrix = keyboard_matrix["matrix"]
 
@@ -82,7 +86,7 @@ def load_config(layout):
     for key in json.load(open(f"tools/layout_key_pos{layout}.json")):
         key_positions[Point(key["x"] + 10, key["y"] + 10)] = key["text"]
 
-    special_keys = json.load(open(f"config/key_config.json"))["special-keys"]
+    special_keys = json.load(open(f"{CONFIG_DIR}/key_config.json"))["special-keys"]
     return key_matrix, key_positions, special_keys
 
 
@@ -156,7 +160,9 @@ if __name__ == "__main__":
             }
             json.dump(
                 layout_w,
-                open(f"config/keyboard_layout/{c64_type}{layout_sufix}.json", "w"),
+                open(
+                    f"{CONFIG_DIR}/keyboard_layout/{c64_type}{layout_sufix}.json", "w"
+                ),
                 indent=4,
             )
             print(f"Saved {saved_files} keys for {c64_type} {layout}")
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# module: (cumulative import budget in ms, modules that must not be imported)
+BUDGETS = {
+    "c64keyboard.cli": (40, ("tkinter", "PIL", "serial")),
+    "c64keyboard.keyboard_logic": (40, ("tkinter", "PIL", "serial")),
+    "c64keyboard.keyboard": (150, ("PIL", "serial")),
+    "c64keyboard.headless": (150, ("tkinter", "PIL")),
+}
+
+
+def import_times(module):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        error = result.stderr.strip().splitlines()[-1]
+        raise RuntimeError(f"Cannot import {module}: {error}")
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def check_module(module, budget, forbidden, runs):
+    best = None
+    imported = set()
+    for _ in range(runs):
+        times = import_times(module)
+        imported = set(times)
+        cumulative = times.get(module, 0) / 1000
+        best = cumulative if best is None else min(best, cumulative)
+
+    failures = []
+    if best > budget:
+        failures.append(f"{best:.1f} ms exceeds budget of {budget} ms")
+    for name in forbidden:
+        if name in imported:
+            failures.append(f"imports {name}")
+
+    status = "FAIL" if failures else "ok"
+    print(f"{status:4} {module}: {best:.1f} ms (budget {budget} ms)")
+    for failure in failures:
+        print(f"     {failure}")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check cold start import budgets")
+    parser.add_argument("-r", "--runs", type=int, default=5)
+    parser.add_argument(
+        "-s", "--scale", type=float, default=1.0, help="multiply all budgets"
+    )
+    args = parser.parse_args()
+
+    ok = True
+    for module, (budget, forbidden) in BUDGETS.items():
+        try:
+            ok &= check_module(module, budget * args.scale, forbidden, args.runs)
+        except RuntimeError as e:
+            print(f"FAIL {e}")
+            ok = False
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()